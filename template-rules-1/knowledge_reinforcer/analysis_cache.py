@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# In-memory LRU of (summary, keywords) results. Setting KR_ANALYSIS_CACHE_DB to a file path also
+# persists results to SQLite, so web workers and batch runs share them.
+CACHE_SIZE = int(os.environ.get('KR_ANALYSIS_CACHE_SIZE', 1024))
+CACHE_DB = os.environ.get('KR_ANALYSIS_CACHE_DB')
+DB_MAX_ROWS = 100000
+DB_PRUNE_EVERY = 1000
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def make_key(text, settings):
+    """Cache key for analyzing text with the given settings string."""
+    return hashlib.sha256(f"{settings}\0{text}".encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Bounded LRU cache of analysis results, optionally backed by a shared SQLite file."""
+
+    def __init__(self, max_items=CACHE_SIZE, db_path=None):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = os.getpid()
+        self._puts = 0
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis (key TEXT PRIMARY KEY, value TEXT, used REAL)"
+            )
+            self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+            if self.conn is None:
+                return None
+            row = self.conn.execute("SELECT value FROM analysis WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            # Refresh the row's last use so pruning keeps results other processes still read
+            self.conn.execute("UPDATE analysis SET used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            summary, keywords = json.loads(row[0])
+            value = (summary, keywords)
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+            if self.conn is None:
+                return
+            self.conn.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?)",
+                              (key, json.dumps(list(value)), time.time()))
+            self._puts += 1
+            if self._puts % DB_PRUNE_EVERY == 0:
+                self.conn.execute(
+                    "DELETE FROM analysis WHERE key NOT IN (SELECT key FROM analysis ORDER BY used DESC LIMIT ?)",
+                    (DB_MAX_ROWS,)
+                )
+            self.conn.commit()
+
+    def _remember(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+
+def get_cache():
+    """The process-wide cache, created on first use (and again in forked children)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.pid != os.getpid():
+            _cache = AnalysisCache(CACHE_SIZE, CACHE_DB)
+        return _cache
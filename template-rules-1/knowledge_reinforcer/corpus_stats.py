@@ -0,0 +1,182 @@
+import json
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from .kb_utils import INDEX_DIRNAME, STATS_BUCKETS, document_buckets, file_lock, term_bucket
+from .pack_store import iter_stored_items, read_stored
+
+# Document frequencies are kept in a fixed-size array of STATS_BUCKETS int32 counters indexed by a
+# stable hash of the term (4 MiB on disk). Lookups and updates are O(1) per term and need no vocabulary.
+# Colliding terms share a counter, which can only make a rare term look slightly more common.
+DF_FILE = 'doc_freq.npy'
+META_FILE = 'corpus_stats.json'
+LOCK_FILE = 'corpus_stats.lock'
+# Exists only while rebuild_stats runs: updates made meanwhile are appended to it as JSON lines and
+# replayed onto the recount before it replaces the old statistics.
+JOURNAL_FILE = 'corpus_stats.journal'
+
+
+class CorpusStats:
+    """Read-only view of the document frequencies of one knowledge base."""
+
+    def __init__(self, doc_freq, num_docs):
+        self.doc_freq = doc_freq
+        self.num_docs = num_docs
+
+    def idf(self, term):
+        """Smoothed inverse document frequency of a lowercase term."""
+        df = int(self.doc_freq[term_bucket(term)])
+        return math.log((1 + self.num_docs) / (1 + df)) + 1.0
+
+
+def _paths(kb_dir):
+    index_dir = os.path.join(kb_dir, INDEX_DIRNAME)
+    return os.path.join(index_dir, DF_FILE), os.path.join(index_dir, META_FILE)
+
+
+def _lock(kb_dir):
+    return file_lock(os.path.join(kb_dir, INDEX_DIRNAME, LOCK_FILE))
+
+
+def _journal_path(kb_dir):
+    return os.path.join(kb_dir, INDEX_DIRNAME, JOURNAL_FILE)
+
+
+def _apply_update(doc_freq, num_docs, old_buckets, new_buckets):
+    """Apply one item's update to doc_freq in place and return the new document count."""
+    if old_buckets is not None:
+        doc_freq[old_buckets] = np.maximum(doc_freq[old_buckets] - 1, 0)
+        num_docs = max(num_docs - 1, 0)
+    if new_buckets is not None:
+        doc_freq[new_buckets] += 1
+        num_docs += 1
+    return num_docs
+
+
+def _read_num_docs(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('num_docs', 0))
+    except FileNotFoundError:
+        return 0
+    except (ValueError, AttributeError) as e:
+        print(f"Warning: {meta_path} is invalid ({e}). Treating the corpus as empty.")
+        return 0
+
+
+def _write_num_docs(meta_path, num_docs):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'num_docs': num_docs}, f)
+    os.replace(tmp_path, meta_path)
+
+
+def num_documents(kb_dir):
+    """Number of documents counted in the statistics of kb_dir, without loading the frequencies."""
+    return _read_num_docs(_paths(kb_dir)[1])
+
+
+def load_stats(kb_dir):
+    """
+    Load the corpus statistics for kb_dir.
+
+    Returns:
+        CorpusStats or None: None when no document has been counted yet.
+    """
+    df_path, meta_path = _paths(kb_dir)
+    num_docs = _read_num_docs(meta_path)
+    if num_docs == 0 or not os.path.exists(df_path):
+        return None
+    return CorpusStats(np.load(df_path, mmap_mode='r'), num_docs)
+
+
+def add_document(kb_dir, content):
+    """Count a newly saved item's terms into the document frequencies of kb_dir."""
+    update_document(kb_dir, None, document_buckets(content))
+
+
+def update_document(kb_dir, old_buckets, new_buckets):
+    """
+    Replace the counted terms of one item: subtract old_buckets (None for an item not counted yet)
+    and add new_buckets (None for an item that is gone).
+
+    The update is a read-modify-write of both files, so it runs under the statistics lock to keep
+    concurrent savers (web threads, the crawler, the watcher) from losing counts. While a rebuild is
+    running the update is also journaled, so the rebuilt statistics include it.
+    """
+    df_path, meta_path = _paths(kb_dir)
+    os.makedirs(os.path.dirname(df_path), exist_ok=True)
+    with _lock(kb_dir):
+        if os.path.exists(df_path):
+            doc_freq = np.load(df_path, mmap_mode='r+')
+        else:
+            doc_freq = np.lib.format.open_memmap(df_path, mode='w+', dtype=np.int32, shape=(STATS_BUCKETS,))
+        num_docs = _apply_update(doc_freq, _read_num_docs(meta_path), old_buckets, new_buckets)
+        doc_freq.flush()
+        del doc_freq
+        _write_num_docs(meta_path, num_docs)
+        journal_path = _journal_path(kb_dir)
+        if os.path.exists(journal_path):
+            with open(journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    'old': old_buckets.tolist() if old_buckets is not None else None,
+                    'new': new_buckets.tolist() if new_buckets is not None else None,
+                }) + '\n')
+
+
+def _item_buckets(task):
+    kb_dir, relative_path = task
+    content = read_stored(kb_dir, relative_path)
+    return document_buckets(content) if content is not None else None
+
+
+def rebuild_stats(kb_dir, workers=None):
+    """
+    Recount the document frequencies of every item stored under kb_dir, as files or in packs.
+
+    Files are streamed to a process pool (one worker per core by default) and the new statistics
+    replace the old ones only once the full pass has finished. The items to count are listed when
+    the pass starts; updates made by savers after that are journaled and replayed onto the recount
+    just before it is swapped in, so they are not lost.
+
+    Returns:
+        int: The number of documents counted.
+    """
+    df_path, meta_path = _paths(kb_dir)
+    journal_path = _journal_path(kb_dir)
+    os.makedirs(os.path.dirname(df_path), exist_ok=True)
+    with _lock(kb_dir):
+        open(journal_path, 'w').close()
+        relative_paths = [relative_path for relative_path, _ in iter_stored_items(kb_dir)]
+    try:
+        doc_freq = np.zeros(STATS_BUCKETS, dtype=np.int32)
+        num_docs = 0
+        with Pool(workers or os.cpu_count()) as pool:
+            tasks = ((kb_dir, relative_path) for relative_path in relative_paths)
+            for buckets in pool.imap_unordered(_item_buckets, tasks, chunksize=64):
+                if buckets is None:
+                    continue
+                doc_freq[buckets] += 1
+                num_docs += 1
+
+        tmp_path = df_path + '.tmp.npy'
+        with _lock(kb_dir):
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    num_docs = _apply_update(
+                        doc_freq, num_docs,
+                        np.array(entry['old'], dtype=np.int64) if entry['old'] is not None else None,
+                        np.array(entry['new'], dtype=np.int64) if entry['new'] is not None else None)
+            np.save(tmp_path, doc_freq)
+            os.replace(tmp_path, df_path)
+            _write_num_docs(meta_path, num_docs)
+            os.remove(journal_path)
+    finally:
+        with _lock(kb_dir):
+            if os.path.exists(journal_path):  # The pass failed before the swap
+                os.remove(journal_path)
+    return num_docs
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+from .fetcher import extract_article, fetch_html
+from .processor import process_content_to_markdown
+from .storage import save_to_knowledge_base
+
+# Links to these are never fetched: they are not pages readability can extract anything from
+SKIPPED_EXTENSIONS = ('.pdf', '.zip', '.gz', '.tar', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp',
+                      '.mp3', '.mp4', '.css', '.js', '.xml', '.json', '.ico')
+
+
+class BloomFilter:
+    """
+    Compact set of seen URLs. Membership tests can return false positives (a page wrongly treated
+    as already seen) at roughly error_rate once `capacity` items are added, but never false negatives.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item):
+        """Add item. Returns True if it was not (seemingly) present before."""
+        added = False
+        for p in self._positions(item):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                self.bits[p >> 3] |= 1 << (p & 7)
+                added = True
+        return added
+
+
+def _normalize_url(url):
+    url, _ = urldefrag(url)
+    return url
+
+
+def _extract_links(base_url, html, site):
+    links = []
+    soup = BeautifulSoup(html, 'html.parser')
+    for anchor in soup.find_all('a', href=True):
+        try:
+            url = _normalize_url(urljoin(base_url, anchor['href']))
+            parsed = urlparse(url)
+        except ValueError:  # Malformed href, such as an unclosed IPv6 bracket
+            continue
+        if parsed.scheme not in ('http', 'https') or parsed.netloc != site:
+            continue
+        if parsed.path.lower().endswith(SKIPPED_EXTENSIONS):
+            continue
+        links.append(url)
+    return links
+
+
+def _fetch_page(url):
+    try:
+        return fetch_html(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+
+
+async def crawl(seed_url, on_page, max_depth=2, max_pages=100, per_host_concurrency=4, concurrency=16):
+    """
+    Crawl same-site pages breadth-first from seed_url and hand each fetched page to on_page(url, html).
+
+    Fetches run in threads with at most per_host_concurrency requests in flight per host. on_page runs
+    in a single background thread as pages arrive, so processing and saving overlap with the crawl but
+    never with each other. At most max_pages pages are fetched, and links are followed max_depth hops
+    from the seed.
+
+    Returns:
+        dict: 'fetched', 'failed' and 'processed' page counts.
+    """
+    seed_url = _normalize_url(seed_url)
+    site = urlparse(seed_url).netloc
+    seen = BloomFilter()
+    seen.add(seed_url)
+    queue = asyncio.Queue()
+    queue.put_nowait((seed_url, 0))
+    scheduled = 1
+    host_limits = {}
+    counts = {'fetched': 0, 'failed': 0, 'processed': 0}
+    loop = asyncio.get_running_loop()
+    processing = []
+
+    def process(url, html):
+        try:
+            on_page(url, html)
+            counts['processed'] += 1
+        except Exception as e:
+            print(f"Error processing {url}: {e}")
+
+    async def worker():
+        nonlocal scheduled
+        while True:
+            url, depth = await queue.get()
+            try:
+                host = urlparse(url).netloc
+                limit = host_limits.setdefault(host, asyncio.Semaphore(per_host_concurrency))
+                async with limit:
+                    html = await asyncio.to_thread(_fetch_page, url)
+                if html is None:
+                    counts['failed'] += 1
+                    continue
+                counts['fetched'] += 1
+                processing.append(loop.run_in_executor(processing_executor, process, url, html))
+
+                if depth < max_depth:
+                    for link in _extract_links(url, html, site):
+                        if scheduled >= max_pages:
+                            break
+                        if seen.add(link):
+                            queue.put_nowait((link, depth + 1))
+                            scheduled += 1
+            except Exception as e:
+                # A worker must outlive any one page, or queue.join() could wait forever
+                print(f"Error crawling {url}: {e}")
+            finally:
+                queue.task_done()
+
+    with ThreadPoolExecutor(max_workers=1) as processing_executor:
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        await queue.join()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await asyncio.gather(*processing)
+    return counts
+
+
+def save_page(url, html, tags, purpose):
+    """Default crawl handler: extract, process and store a page like `main.py --url` does."""
+    content, title = extract_article(html)
+    title = title or "Untitled"
+    markdown_content = process_content_to_markdown(content, "web-article", url, title, tags, purpose)
+    filename_base = re.sub(r'[^a-zA-Z0-9_]', '', title.replace(' ', '_'))[:50] or "untitled"
+    # Pages of one site often share a title, so the URL hash keeps their filenames apart
+    url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+    filename = f"{filename_base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{url_hash}.md"
+    save_to_knowledge_base(filename, markdown_content, "web-article")
+
+
+def crawl_site(seed_url, tags, purpose, max_depth=2, max_pages=100, per_host_concurrency=4):
+    """Crawl a site from seed_url into the knowledge base. Returns the page counts of crawl()."""
+    return asyncio.run(crawl(
+        seed_url,
+        lambda url, html: save_page(url, html, tags, purpose),
+        max_depth=max_depth,
+        max_pages=max_pages,
+        per_host_concurrency=per_host_concurrency
+    ))
@@ -13,13 +13,20 @@ def _get_youtube_video_id(url):
         return parsed_url.path[1:]
     return None
 
+def fetch_html(url, timeout=10):
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
+    return response.text
+
+def extract_article(html):
+    # Readability keeps the main article content and drops navigation and boilerplate
+    doc = Document(html)
+    return doc.content(), doc.title()
+
 def fetch_content(url, content_type):
     if content_type == "web-article":
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-            doc = Document(response.text)
-            return doc.content(), doc.title()
+            return extract_article(fetch_html(url))
         except requests.exceptions.RequestException as e:
             print(f"Error fetching web article from {url}: {e}")
             return None, None
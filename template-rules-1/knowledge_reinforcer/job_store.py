@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import time
+
+from .kb_utils import INDEX_DIRNAME
+
+# Status of API ingest jobs, kept in SQLite so every web worker process (and a restarted server)
+# can answer /api/jobs for jobs queued by another. Only the newest MAX_TRACKED_JOBS are kept.
+JOBS_FILE = 'jobs.sqlite3'
+MAX_TRACKED_JOBS = 10000
+# SQLite before 3.32 allows at most 999 bound variables per statement
+QUERY_CHUNK = 500
+
+
+def connect(kb_dir):
+    index_dir = os.path.join(kb_dir, INDEX_DIRNAME)
+    os.makedirs(index_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(index_dir, JOBS_FILE), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, path TEXT, error TEXT, updated REAL)"
+    )
+    return conn
+
+
+def create_jobs(kb_dir, jobs):
+    """Record new jobs, given (job_id, status, error) tuples, and drop the oldest beyond MAX_TRACKED_JOBS."""
+    now = time.time()
+    with connect(kb_dir) as conn:
+        conn.executemany("INSERT INTO jobs (id, status, error, updated) VALUES (?, ?, ?, ?)",
+                         [(job_id, status, error, now) for job_id, status, error in jobs])
+        # Rows are never re-inserted, so rowid order is creation order
+        conn.execute("DELETE FROM jobs WHERE rowid <= (SELECT MAX(rowid) FROM jobs) - ?", (MAX_TRACKED_JOBS,))
+    conn.close()
+
+
+def update_job(kb_dir, job_id, status, path=None, error=None):
+    with connect(kb_dir) as conn:
+        conn.execute("UPDATE jobs SET status = ?, path = ?, error = ?, updated = ? WHERE id = ?",
+                     (status, path, error, time.time(), job_id))
+    conn.close()
+
+
+def get_jobs(kb_dir, job_ids):
+    """Dict of job id -> {'status', plus 'path' or 'error' when set}; unknown ids get status 'unknown'."""
+    jobs = {job_id: {'status': 'unknown'} for job_id in job_ids}
+    ids = list(jobs)
+    conn = connect(kb_dir)
+    try:
+        for start in range(0, len(ids), QUERY_CHUNK):
+            chunk = ids[start:start + QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for job_id, status, path, error in conn.execute(
+                    f"SELECT id, status, path, error FROM jobs WHERE id IN ({placeholders})", chunk):
+                job = {'status': status}
+                if path is not None:
+                    job['path'] = path
+                if error is not None:
+                    job['error'] = error
+                jobs[job_id] = job
+    finally:
+        conn.close()
+    return jobs
@@ -1,7 +1,18 @@
 import os
 import json
+import re
+import threading
+import zlib
+import numpy as np
+import yaml
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where file_lock only serialises threads of one process
+    fcntl = None
+
 # Determine paths relative to this file's location
 # Assumes kb_utils.py is in knowledge_reinforcer/
 # and knowledge_base/ is a sibling to knowledge_reinforcer/
@@ -25,6 +36,12 @@ KB_BASE_DIR = os.path.join(PROJECT_ROOT, 'knowledge_base')
 COUNTER_FILE = os.path.join(KB_BASE_DIR, 'kb_counter.txt')
 INDEX_FILE = os.path.join(KB_BASE_DIR, 'kb_index.json')
 
+# Derived data (vector index, corpus statistics) lives here, inside each knowledge base directory
+INDEX_DIRNAME = '.index'
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
 
 def get_next_sequence_number():
     """
@@ -115,6 +132,83 @@ def add_to_index(item_metadata):
         # Consider how to handle this - rollback?
         raise Exception(f"Critical error in add_to_index: {e}")
 
+def split_front_matter(content):
+    """
+    Split a stored knowledge base item into its YAML front matter and markdown body.
+    
+    Returns:
+        tuple: (metadata dict, markdown body). Content without front matter, or with invalid YAML, yields an empty dict and the whole content as the body.
+    """
+    parts = content.split('---\n', 2)
+    if len(parts) > 2 and parts[0] == '':
+        try:
+            metadata = yaml.safe_load(parts[1]) or {}
+        except yaml.YAMLError as e:
+            print(f"Error parsing YAML front matter: {e}")
+            return {}, content
+        if isinstance(metadata, dict):
+            return metadata, parts[2]
+    return {}, content
+
+# Corpus statistics count terms in a fixed-size array of STATS_BUCKETS counters, indexed by a
+# stable hash of the term. The manifest keeps each file's buckets, so edits and deletes can be
+# subtracted again; both use these helpers.
+STATS_BUCKETS = 1 << 20
+
+_TERM_RE = re.compile(r'[a-z0-9]+')
+
+def term_bucket(term):
+    return zlib.crc32(term.encode('utf-8')) & (STATS_BUCKETS - 1)
+
+def document_buckets(content):
+    """Sorted unique term buckets of a stored item's title and markdown body."""
+    metadata, body = split_front_matter(content)
+    text = f"{metadata.get('title') or ''}\n{body}".lower()
+    buckets = {term_bucket(term) for term in _TERM_RE.findall(text)}
+    return np.array(sorted(buckets), dtype=np.int64)
+
+def iter_markdown_files(kb_dir):
+    """
+    Yield the absolute path of every markdown item under kb_dir, in a stable sorted order.
+    
+    Derived-data directories such as INDEX_DIRNAME are skipped. Paths are produced while walking, so large trees are never listed in full.
+    """
+    for root, dirs, files in os.walk(kb_dir):
+        dirs[:] = sorted(d for d in dirs if d != INDEX_DIRNAME)
+        for file in sorted(files):
+            if file.endswith('.md'):
+                yield os.path.join(root, file)
+
+def walk_order_key(relative_path):
+    """
+    Sort key matching the order of iter_markdown_files: the files of a directory come before its
+    subdirectories, and names sort within each level.
+    """
+    parts = relative_path.replace(os.sep, '/').split('/')
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+@contextmanager
+def file_lock(lock_path):
+    """
+    Hold an exclusive lock on lock_path for the duration of a with block.
+    
+    Writers of shared derived data (the vector index, corpus statistics, packs) may run in several threads of the web app and in other processes at once (`--watch`, `--crawl`). A threading.Lock per path serialises the threads of this process and an fcntl.flock on the lock file serialises processes.
+    """
+    lock_path = os.path.abspath(lock_path)
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(lock_path, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
 if __name__ == '__main__':
     # Simple test cases (run this file directly to test)
     print(f"Counter file: {COUNTER_FILE}")
@@ -6,7 +6,13 @@ import re
 
 from .fetcher import fetch_content
 from .processor import process_content_to_markdown
-from .storage import save_to_knowledge_base
+from .storage import save_to_knowledge_base, migrate_to_sharded, resolve_path, BASE_KNOWLEDGE_DIR
+from .vector_index import MIN_LSA_DOCS, find_related, get_index, query_related, rebuild_index
+from .corpus_stats import rebuild_stats
+from .reprocess import reprocess_knowledge_base
+from .pack_store import export_packs, pack_existing_files
+from .crawler import crawl_site
+from .watcher import run_watcher
 from .nltk_setup import ensure_nltk_resources
 
 def main():
@@ -19,6 +25,27 @@ def main():
     parser.add_argument("--tags", type=str, default="", help="Comma-separated tags for the content (e.g., 'AI,NLP,Design Patterns').")
     parser.add_argument("--purpose", type=str, default="", help="A brief statement on why this information is relevant for AI coding (e.g., 'New design pattern', 'Best practice for secure APIs').")
     parser.add_argument("--web", action="store_true", help="Run the web interface.")
+    parser.add_argument("--watch", action="store_true", help="Watch knowledge_base/ and keep the indexes in sync with hand-edited files.")
+    parser.add_argument("--crawl", type=str, metavar="SEED_URL", help="Crawl same-site pages linked from SEED_URL into the knowledge base.")
+    parser.add_argument("--max-depth", type=int, default=2, help="With --crawl, how many links away from the seed to follow (default: 2).")
+    parser.add_argument("--max-pages", type=int, default=100, help="With --crawl, the maximum number of pages to fetch (default: 100).")
+    parser.add_argument("--per-host", type=int, default=4, help="With --crawl, the maximum concurrent requests per host (default: 4).")
+    parser.add_argument("--related", type=str, help="Show items related in meaning to a stored item (path relative to knowledge_base/).")
+    parser.add_argument("--query", type=str, help="Show the stored items most related in meaning to free text.")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of related items to show with --related or --query (default: 5).")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the related-items vector index from every stored item.")
+    parser.add_argument("--rebuild-stats", action="store_true", help="Recount corpus term statistics (used for TF-IDF keywords and summaries) from every stored item.")
+    parser.add_argument("--migrate-layout", action="store_true", help="Move items of the old flat knowledge_base layout into shard subdirectories.")
+    parser.add_argument("--pack-files", action="store_true", help="Move every plain markdown item into compressed pack files (see KR_STORAGE_BACKEND).")
+    parser.add_argument("--export-packs", type=str, metavar="DIR", help="Write every packed item to DIR as a plain markdown file.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for bulk commands (default: one per CPU core).")
+    parser.add_argument("--reprocess", action="store_true", help="Regenerate summary and extracted keywords of stored items in place.")
+    parser.add_argument("--source-type", type=str, choices=["web-article", "youtube-video", "direct-text"], help="With --reprocess, only touch items of this source type.")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="With --reprocess, only touch items extracted at or after this ISO date/time.")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="With --reprocess, only touch items extracted at or before this ISO date/time.")
+    parser.add_argument("--dry-run", action="store_true", help="With --reprocess, do all the work but write nothing, and report throughput.")
+    parser.add_argument("--force", action="store_true", help="With --reprocess, also redo items already processed by the current processor version.")
+    parser.add_argument("--restart", action="store_true", help="With --reprocess, ignore the checkpoint of an interrupted run.")
 
     args = parser.parse_args()
 
@@ -27,6 +54,87 @@ def main():
         web_app.app.run(debug=True, port=3005)
         return
 
+    if args.watch:
+        run_watcher(BASE_KNOWLEDGE_DIR)
+        return
+
+    if args.crawl:
+        counts = crawl_site(
+            args.crawl,
+            args.tags.split(',') if args.tags else [],
+            args.purpose,
+            max_depth=args.max_depth,
+            max_pages=args.max_pages,
+            per_host_concurrency=args.per_host
+        )
+        print(f"Crawl finished: {counts['fetched']} pages fetched, {counts['processed']} saved, {counts['failed']} failed.")
+        return
+
+    if args.migrate_layout:
+        count = migrate_to_sharded(BASE_KNOWLEDGE_DIR)
+        print(f"Moved {count} items into shard directories.")
+        return
+
+    if args.pack_files:
+        count = pack_existing_files(BASE_KNOWLEDGE_DIR)
+        print(f"Packed {count} items.")
+        return
+
+    if args.export_packs:
+        count = export_packs(BASE_KNOWLEDGE_DIR, args.export_packs)
+        print(f"Exported {count} packed items to {args.export_packs}.")
+        return
+
+    if args.reindex:
+        count = rebuild_index(BASE_KNOWLEDGE_DIR)
+        if get_index(BASE_KNOWLEDGE_DIR).projection() is not None:
+            print(f"Indexed {count} items with a newly fitted LSA projection.")
+        else:
+            print(f"Indexed {count} items by keyword hashing (an LSA projection needs at least {MIN_LSA_DOCS} items).")
+        return
+
+    if args.rebuild_stats:
+        count = rebuild_stats(BASE_KNOWLEDGE_DIR, args.workers)
+        print(f"Counted term statistics for {count} items.")
+        return
+
+    if args.reprocess:
+        result = reprocess_knowledge_base(
+            BASE_KNOWLEDGE_DIR,
+            source_type=args.source_type,
+            since=args.since,
+            until=args.until,
+            dry_run=args.dry_run,
+            force=args.force,
+            restart=args.restart,
+            workers=args.workers
+        )
+        elapsed = result.pop('elapsed')
+        rate = result.pop('items_per_second')
+        outcome = ', '.join(f"{status}: {count}" for status, count in sorted(result.items()))
+        prefix = "Dry run - " if args.dry_run else ""
+        print(f"{prefix}{outcome or 'no items'} in {elapsed:.1f}s ({rate:.1f} items/s).")
+        return
+
+    if args.related:
+        stored_path = resolve_path(BASE_KNOWLEDGE_DIR, args.related) or args.related
+        matches = find_related(BASE_KNOWLEDGE_DIR, stored_path, args.top_k)
+        if matches is None:
+            print(f"{args.related} is not in the index. Run with --reindex to index existing items.")
+            return
+        for path, score in matches:
+            print(f"{score:.3f}  {path}")
+        return
+
+    if args.query:
+        matches = query_related(BASE_KNOWLEDGE_DIR, args.query, args.top_k)
+        if not matches:
+            print("No indexed item is related to that text. Run with --reindex to index existing items.")
+            return
+        for path, score in matches:
+            print(f"{score:.3f}  {path}")
+        return
+
     if not args.url and not args.text:
         parser.error("Either --url or --text must be provided.")
 
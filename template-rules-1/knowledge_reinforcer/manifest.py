@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import zlib
+
+import numpy as np
+
+from .kb_utils import INDEX_DIRNAME, document_buckets, iter_markdown_files, split_front_matter
+
+# One row per markdown file: its size and mtime when it was last indexed, plus the metadata browse
+# needs. Comparing a stat() against this is enough to tell whether a file changed since. Each row
+# also keeps the term buckets the file was counted with in the corpus statistics (delta-encoded and
+# compressed), so an edit or delete can subtract them again; rows of older manifests have none.
+MANIFEST_FILE = 'manifest.sqlite3'
+# SQLite before 3.32 allows at most 999 bound variables per statement
+QUERY_CHUNK = 500
+
+
+def connect(kb_dir):
+    index_dir = os.path.join(kb_dir, INDEX_DIRNAME)
+    os.makedirs(index_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(index_dir, MANIFEST_FILE), timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS files ("
+        "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, title TEXT, date_extracted TEXT, buckets BLOB)"
+    )
+    if 'buckets' not in [column[1] for column in conn.execute("PRAGMA table_info(files)")]:
+        conn.execute("ALTER TABLE files ADD COLUMN buckets BLOB")
+    return conn
+
+
+def _encode_buckets(buckets):
+    return zlib.compress(np.diff(buckets, prepend=0).astype(np.int32).tobytes())
+
+
+def _decode_buckets(blob):
+    return np.cumsum(np.frombuffer(zlib.decompress(blob), dtype=np.int32), dtype=np.int64)
+
+
+def _title_and_date(content):
+    metadata, _ = split_front_matter(content)
+    date_extracted = metadata.get('date_extracted')
+    return metadata.get('title'), str(date_extracted) if date_extracted else None
+
+
+def describe(kb_dir, relative_path, content, buckets=None):
+    """Manifest row for a file whose content has just been read (or written), and whose terms are counted as buckets."""
+    stat = os.stat(os.path.join(kb_dir, relative_path))
+    if buckets is None:
+        buckets = document_buckets(content)
+    return (relative_path, stat.st_mtime_ns, stat.st_size, *_title_and_date(content), _encode_buckets(buckets))
+
+
+def record_file(kb_dir, relative_path, content):
+    """Mark a file as indexed, and counted in the corpus statistics, in its current state."""
+    with connect(kb_dir) as conn:
+        conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", describe(kb_dir, relative_path, content))
+    conn.close()
+
+
+def forget_file(kb_dir, relative_path):
+    with connect(kb_dir) as conn:
+        conn.execute("DELETE FROM files WHERE path = ?", (relative_path,))
+    conn.close()
+
+
+def update_rows(kb_dir, records, removed):
+    """Write rows built by describe() and delete the rows of removed paths, in one transaction."""
+    with connect(kb_dir) as conn:
+        conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", records)
+        conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+    conn.close()
+
+
+def rename_files(kb_dir, renames):
+    """Move manifest rows to new paths, given a dict of old path -> new path."""
+    with connect(kb_dir) as conn:
+        conn.executemany("UPDATE files SET path = ? WHERE path = ?", [(new, old) for old, new in renames.items()])
+    conn.close()
+
+
+def get_row(kb_dir, relative_path):
+    """
+    Manifest row (mtime_ns, size, title, date_extracted, has_buckets) of one file, or None if it is not
+    recorded. has_buckets is false for rows of older manifests, whose counted terms are unknown.
+    """
+    conn = connect(kb_dir)
+    try:
+        return conn.execute("SELECT mtime_ns, size, title, date_extracted, buckets IS NOT NULL FROM files WHERE path = ?",
+                            (relative_path,)).fetchone()
+    finally:
+        conn.close()
+
+
+def is_unchanged(row, stat):
+    return row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size
+
+
+def load_rows(kb_dir):
+    """All manifest rows as a dict of path -> (mtime_ns, size, title, date_extracted, has_buckets)."""
+    conn = connect(kb_dir)
+    try:
+        return {row[0]: row[1:] for row in conn.execute(
+            "SELECT path, mtime_ns, size, title, date_extracted, buckets IS NOT NULL FROM files")}
+    finally:
+        conn.close()
+
+
+def load_buckets(kb_dir, paths):
+    """Counted term buckets of the given files, as a dict of path -> array; files without any are left out."""
+    paths = list(paths)
+    buckets = {}
+    conn = connect(kb_dir)
+    try:
+        for start in range(0, len(paths), QUERY_CHUNK):
+            chunk = paths[start:start + QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for path, blob in conn.execute(
+                    f"SELECT path, buckets FROM files WHERE buckets IS NOT NULL AND path IN ({placeholders})", chunk):
+                buckets[path] = _decode_buckets(blob)
+    finally:
+        conn.close()
+    return buckets
+
+
+def scan_changes(kb_dir, rows=None):
+    """
+    Compare the files on disk with the manifest using stat() only.
+
+    Returns:
+        tuple: (changed, removed) lists of relative paths. New files count as changed.
+    """
+    if rows is None:
+        rows = load_rows(kb_dir)
+    changed = []
+    seen = set()
+    for file_path in iter_markdown_files(kb_dir):
+        relative_path = os.path.relpath(file_path, kb_dir)
+        seen.add(relative_path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        if not is_unchanged(rows.get(relative_path), stat):
+            changed.append(relative_path)
+    removed = [path for path in rows if path not in seen]
+    return changed, removed
+
+
+def list_items(kb_dir):
+    """
+    Title and extraction date of every markdown file, as a dict of path -> (title, date_extracted).
+
+    Unchanged files come straight from the manifest; only files that changed since they were last
+    indexed are parsed. The manifest itself is left for the watcher to update.
+    """
+    rows = load_rows(kb_dir)
+    changed, removed = scan_changes(kb_dir, rows)
+    items = {path: (row[2], row[3]) for path, row in rows.items()}
+    for path in removed:
+        del items[path]
+    for path in changed:
+        try:
+            with open(os.path.join(kb_dir, path), 'r', encoding='utf-8') as f:
+                title, date_extracted = _title_and_date(f.read())
+        except FileNotFoundError:
+            items.pop(path, None)
+            continue
+        items[path] = (title, date_extracted)
+    return items
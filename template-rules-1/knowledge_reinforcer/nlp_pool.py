@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Summaries and keywords are CPU-bound pure Python and hold the GIL, so they run in a pool of
+# worker processes shared by everything in this process (Flask request threads, the CLI, the
+# crawler). KR_NLP_WORKERS=0 runs them inline instead.
+NLP_WORKERS = int(os.environ.get('KR_NLP_WORKERS', os.cpu_count() or 1))
+
+_executor = None
+_executor_lock = threading.Lock()
+_inline = False
+
+
+def _init_worker():
+    global _inline
+    # A worker must never dispatch to a pool of its own
+    _inline = True
+    from . import processor  # Importing the processor also ensures the NLTK data is present
+    try:
+        processor.warm_up()
+    except LookupError as e:
+        print(f"NLP worker {os.getpid()} could not preload NLTK data: {e}")
+
+
+def _ping():
+    return os.getpid()
+
+
+def _analyze_in_worker(text, num_sentences, num_keywords, kb_dir):
+    from .processor import analyze_text_local
+    return analyze_text_local(text, num_sentences, num_keywords, kb_dir)
+
+
+def run_inline():
+    """Run analysis in the calling process from now on. Used as initializer by other process pools."""
+    global _inline
+    _inline = True
+
+
+def start_pool():
+    """
+    Start the worker pool if it is enabled and not running yet, and pre-warm every worker.
+
+    Workers are spawned rather than forked, since the caller may be a multi-threaded web server.
+    Returns the executor, or None when analysis runs inline.
+    """
+    global _executor
+    if _inline or NLP_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=NLP_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+            # The executor only starts processes as work arrives; one ping per worker starts them all now
+            for _ in range(NLP_WORKERS):
+                _executor.submit(_ping)
+        return _executor
+
+
+def shutdown_pool():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def analyze(text, num_sentences, num_keywords, kb_dir):
+    """Return (summary, keywords) for text, computed by a pool worker when the pool is enabled."""
+    global _executor
+    executor = start_pool()
+    if executor is not None:
+        try:
+            return executor.submit(_analyze_in_worker, text, num_sentences, num_keywords, kb_dir).result()
+        except BrokenProcessPool as e:
+            print(f"NLP worker pool failed ({e}). Restarting it on next use; analyzing inline.")
+            with _executor_lock:
+                if _executor is executor:
+                    _executor = None
+    return _analyze_in_worker(text, num_sentences, num_keywords, kb_dir)
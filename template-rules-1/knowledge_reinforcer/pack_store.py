@@ -0,0 +1,206 @@
+import gzip
+import json
+import mmap
+import os
+
+try:
+    import zstandard
+except ImportError:  # Optional: packs fall back to gzip when zstandard is not installed
+    zstandard = None
+
+from .kb_utils import file_lock, iter_markdown_files, split_front_matter, walk_order_key
+from .manifest import forget_file
+
+PACKS_DIRNAME = '.packs'
+PACK_INDEX_FILE = 'pack_index.jsonl'
+PACK_LOCK_FILE = 'packs.lock'
+MAX_PACK_BYTES = 512 * 1024 * 1024
+
+_stores = {}
+
+
+def _compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), 'zstd'
+    return gzip.compress(data, compresslevel=6), 'gzip'
+
+
+def _decompress(blob, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This pack item is zstd-compressed; install 'zstandard' to read it.")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+class PackStore:
+    """
+    Append-only compressed storage for one knowledge base directory.
+
+    Every item is compressed on its own and appended to the current pack file
+    (.packs/pack-00000.pack, ...), so a single item can be read back from a memory map without
+    touching its neighbours. pack_index.jsonl records one line per append with the item's relative
+    path, location, codec, title and extraction date; a later line for the same path wins. Appends
+    hold a lock across threads and processes, so concurrent writers never interleave.
+    """
+
+    def __init__(self, kb_dir):
+        self.packs_dir = os.path.join(kb_dir, PACKS_DIRNAME)
+        self.index_path = os.path.join(self.packs_dir, PACK_INDEX_FILE)
+        self.lock_path = os.path.join(self.packs_dir, PACK_LOCK_FILE)
+        self.entries = {}
+        self._stamp = None
+        self._maps = {}
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            self.entries, self._stamp = {}, None
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        entries = {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry['path']] = entry
+        self.entries = entries
+        self._stamp = stamp
+
+    def _pack_path(self, pack_no):
+        return os.path.join(self.packs_dir, f"pack-{pack_no:05d}.pack")
+
+    def _current_pack(self):
+        pack_no = max((entry['pack'] for entry in self.entries.values()), default=0)
+        path = self._pack_path(pack_no)
+        if os.path.exists(path) and os.path.getsize(path) >= MAX_PACK_BYTES:
+            pack_no += 1
+        return pack_no
+
+    def append(self, relative_path, content):
+        blob, codec = _compress(content.encode('utf-8'))
+        metadata, _ = split_front_matter(content)
+        os.makedirs(self.packs_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            # Refreshed under the lock, so the current pack reflects appends made by other writers
+            self._refresh()
+            pack_no = self._current_pack()
+            with open(self._pack_path(pack_no), 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(blob)
+            entry = {
+                'path': relative_path,
+                'pack': pack_no,
+                'offset': offset,
+                'length': len(blob),
+                'codec': codec,
+                'title': metadata.get('title'),
+                'date_extracted': str(metadata['date_extracted']) if metadata.get('date_extracted') else None,
+            }
+            # The index line is written after the data, so a crash mid-append leaves only unreferenced bytes
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.entries[relative_path] = entry
+            self._stamp = None
+
+    def _map(self, pack_no, end):
+        mapped = self._maps.get(pack_no)
+        if mapped is None or len(mapped) < end:
+            # (Re)map when the pack has grown since it was last mapped. The old map is left for the
+            # garbage collector rather than closed, since another thread may still be reading from it.
+            with open(self._pack_path(pack_no), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[pack_no] = mapped
+        return mapped
+
+    def read(self, relative_path):
+        """Return the markdown content of a packed item, or None if it is not in the packs."""
+        self._refresh()
+        entry = self.entries.get(relative_path)
+        if entry is None:
+            return None
+        end = entry['offset'] + entry['length']
+        blob = self._map(entry['pack'], end)[entry['offset']:end]
+        return _decompress(blob, entry['codec']).decode('utf-8')
+
+    def items(self):
+        """Index entries (dicts with 'path', 'title' and 'date_extracted') of every packed item."""
+        self._refresh()
+        return list(self.entries.values())
+
+
+def get_store(kb_dir):
+    key = os.path.abspath(kb_dir)
+    if key not in _stores:
+        _stores[key] = PackStore(kb_dir)
+    return _stores[key]
+
+
+def pack_item(kb_dir, relative_path, content):
+    get_store(kb_dir).append(relative_path, content)
+
+
+def read_packed(kb_dir, relative_path):
+    return get_store(kb_dir).read(relative_path)
+
+
+def packed_items(kb_dir):
+    return get_store(kb_dir).items()
+
+
+def iter_stored_items(kb_dir):
+    """
+    Yield (relative_path, packed) for every stored item of either backend.
+
+    Plain markdown files come first, in iter_markdown_files order, then the items that only exist
+    in packs, sorted the same way. A path that is both a file and packed is yielded once, as a file.
+    """
+    seen = set()
+    for file_path in iter_markdown_files(kb_dir):
+        relative_path = os.path.relpath(file_path, kb_dir)
+        seen.add(relative_path)
+        yield relative_path, False
+    packed_only = [entry['path'] for entry in packed_items(kb_dir) if entry['path'] not in seen]
+    for relative_path in sorted(packed_only, key=walk_order_key):
+        yield relative_path, True
+
+
+def read_stored(kb_dir, relative_path):
+    """Content of a stored item from either backend (a plain file wins), or None if it is gone."""
+    try:
+        with open(os.path.join(kb_dir, relative_path), 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return read_packed(kb_dir, relative_path)
+
+
+def pack_existing_files(kb_dir):
+    """Move every plain markdown item under kb_dir into the packs. Returns the number of items packed."""
+    store = get_store(kb_dir)
+    count = 0
+    for file_path in iter_markdown_files(kb_dir):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        relative_path = os.path.relpath(file_path, kb_dir)
+        store.append(relative_path, content)
+        os.remove(file_path)
+        # The item lives on in the packs, so the watcher must not treat the removal as a delete
+        forget_file(kb_dir, relative_path)
+        count += 1
+    return count
+
+
+def export_packs(kb_dir, dest_dir):
+    """Write the latest version of every packed item to dest_dir as a plain markdown file, keeping its relative path."""
+    store = get_store(kb_dir)
+    count = 0
+    for entry in store.items():
+        target_path = os.path.join(dest_dir, entry['path'])
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with open(target_path, 'w', encoding='utf-8') as f:
+            f.write(store.read(entry['path']))
+        count += 1
+    return count
@@ -8,10 +8,38 @@ from collections import defaultdict
 from bs4 import BeautifulSoup
 from rake_nltk import Rake
 import re
+import hashlib
+from functools import lru_cache
 from .nltk_setup import ensure_nltk_resources
+from .corpus_stats import load_stats, num_documents
+from . import analysis_cache
+from . import nlp_pool
+from . import storage
 
 ensure_nltk_resources()
 
+# Bump PROCESSOR_VERSION whenever summary/keyword generation changes, so `main.py --reprocess`
+# regenerates the front matter of items produced by an older processor.
+PROCESSOR_VERSION = 2
+SUMMARY_SENTENCES = 1
+NUM_KEYWORDS = 3
+
+def processor_fingerprint():
+    return f"{PROCESSOR_VERSION}:{SUMMARY_SENTENCES}:{NUM_KEYWORDS}"
+
+def content_hash(markdown_body):
+    return hashlib.sha1(markdown_body.strip().encode('utf-8')).hexdigest()
+
+@lru_cache(maxsize=None)
+def _english_stopwords():
+    # Loaded once per process instead of on every summary/keyword call
+    return frozenset(stopwords.words('english'))
+
+def warm_up():
+    """Load stopwords and tokenizer data up front, so the first real request does not pay for it."""
+    _english_stopwords()
+    word_tokenize(" ".join(sent_tokenize("Warm up the tokenizers. Then stop.")))
+
 def _clean_text(text):
     # Remove URLs
     text = re.sub(r'https?://\S+|www\.\S+', '', text)
@@ -23,7 +51,7 @@ def _clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def _generate_summary(text, num_sentences=1):
+def _generate_summary(text, num_sentences=1, stats=None):
     if not text:
         return ""
 
@@ -34,7 +62,7 @@ def _generate_summary(text, num_sentences=1):
 
     # Tokenize words and remove stopwords
     words = word_tokenize(text.lower())
-    stop_words = set(stopwords.words('english'))
+    stop_words = _english_stopwords()
     filtered_words = [word for word in words if word.isalnum() and word not in stop_words]
 
     # Calculate word frequencies
@@ -42,12 +70,18 @@ def _generate_summary(text, num_sentences=1):
     for word in filtered_words:
         word_freq[word] += 1
 
-    # Score sentences based on word frequencies
+    # Weight words by how rare they are across the knowledge base (TF-IDF) when corpus stats exist
+    if stats is not None:
+        word_weight = {word: freq * stats.idf(word) for word, freq in word_freq.items()}
+    else:
+        word_weight = word_freq
+
+    # Score sentences based on word weights
     sentence_scores = defaultdict(int)
     for i, sentence in enumerate(sentences):
         for word in word_tokenize(sentence.lower()):
-            if word in word_freq:
-                sentence_scores[i] += word_freq[word]
+            if word in word_weight:
+                sentence_scores[i] += word_weight[word]
 
     # Get top sentences
     ranked_sentences = sorted(sentence_scores.items(), key=lambda x: x[1], reverse=True)
@@ -56,13 +90,56 @@ def _generate_summary(text, num_sentences=1):
     summary = " ".join([sentences[idx] for idx in summary_sentences_indices])
     return summary
 
-def _extract_keywords(text, num_keywords=3):
+def _extract_keywords(text, num_keywords=3, stats=None):
     if not text:
         return []
-    r = Rake(stopwords=nltk.corpus.stopwords.words('english'))
+    r = Rake(stopwords=_english_stopwords())
     r.extract_keywords_from_text(text)
-    ranked_phrases = r.get_ranked_phrases()
-    return ranked_phrases[:num_keywords]
+    if stats is None:
+        ranked_phrases = r.get_ranked_phrases()
+        return ranked_phrases[:num_keywords]
+
+    # Scale each RAKE score by the mean IDF of the phrase's words so corpus-wide generic terms sink
+    scored_phrases = []
+    for score, phrase in r.get_ranked_phrases_with_scores():
+        words = phrase.split()
+        mean_idf = sum(stats.idf(word) for word in words) / len(words)
+        scored_phrases.append((score * mean_idf, phrase))
+    scored_phrases.sort(key=lambda x: x[0], reverse=True)
+    return [phrase for _, phrase in scored_phrases[:num_keywords]]
+
+def analyze_text(text, num_sentences=SUMMARY_SENTENCES, num_keywords=NUM_KEYWORDS):
+    """
+    Summary and keywords for text, TF-IDF weighted against the knowledge base when it has statistics.
+
+    The work is dispatched to the shared NLP worker pool (see nlp_pool.py) when it is enabled.
+    Results are memoized in analysis_cache, keyed by the text and the processor settings. The key
+    also includes the corpus size rounded to a power of two, so IDF-weighted results are recomputed
+    each time the knowledge base doubles rather than after every save.
+    """
+    kb_dir = storage.BASE_KNOWLEDGE_DIR
+    settings = f"{processor_fingerprint()}:{num_sentences}:{num_keywords}:{num_documents(kb_dir).bit_length()}"
+    key = analysis_cache.make_key(text, settings)
+    cache = analysis_cache.get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    result = nlp_pool.analyze(text, num_sentences, num_keywords, kb_dir)
+    cache.put(key, result)
+    return result
+
+def analyze_text_local(text, num_sentences, num_keywords, kb_dir):
+    """analyze_text() in the calling process. This is what NLP pool workers run."""
+    stats = load_stats(kb_dir)
+    summary = _generate_summary(text, num_sentences, stats=stats)
+    extracted_keywords = _extract_keywords(text, num_keywords, stats=stats)
+    return summary, extracted_keywords
+
+def text_for_analysis(markdown_body, content_type):
+    """Text to summarize for an already stored item, whose original raw content is no longer available."""
+    if content_type == "direct-text":
+        return _clean_text(markdown_body)
+    return markdown_body
 
 def process_content_to_markdown(raw_content, content_type, source_url, title, tags, purpose):
     markdown_body = ""
@@ -78,11 +155,8 @@ def process_content_to_markdown(raw_content, content_type, source_url, title, ta
         markdown_body = raw_content
         text_for_processing = _clean_text(raw_content)
 
-    # Generate summary
-    summary = _generate_summary(text_for_processing)
-
-    # Extract keywords
-    extracted_keywords = _extract_keywords(text_for_processing)
+    # Generate summary and extract keywords
+    summary, extracted_keywords = analyze_text(text_for_processing)
 
     # Create YAML front matter
     metadata = {
@@ -93,7 +167,9 @@ def process_content_to_markdown(raw_content, content_type, source_url, title, ta
         "user_tags": tags,
         "user_purpose": purpose,
         "summary": summary, # Add the generated summary
-        "extracted_keywords": extracted_keywords # Add the extracted keywords
+        "extracted_keywords": extracted_keywords, # Add the extracted keywords
+        "processor_version": processor_fingerprint(),
+        "content_hash": content_hash(markdown_body)
     }
 
     front_matter = f"---\n{yaml.dump(metadata, sort_keys=False)}---\n\n"
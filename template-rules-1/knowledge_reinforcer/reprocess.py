@@ -0,0 +1,179 @@
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import dropwhile
+from multiprocessing import Pool
+
+import yaml
+
+from .kb_utils import INDEX_DIRNAME, split_front_matter, walk_order_key
+from .manifest import record_file
+from .pack_store import iter_stored_items, pack_item, read_stored
+from .vector_index import index_document
+from .processor import analyze_text, content_hash, processor_fingerprint, text_for_analysis
+from .nlp_pool import run_inline
+
+CHECKPOINT_FILE = 'reprocess_checkpoint.json'
+CHECKPOINT_EVERY = 500
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _write_atomic(file_path, content):
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+
+
+def _reprocess_item(task):
+    """
+    Regenerate the summary and keywords of one stored item. Runs in a pool worker.
+
+    Plain files are rewritten here; the new content of a packed item is returned for the parent to
+    append, so the packs have a single writer per run.
+
+    Returns:
+        tuple: (status, new content or None). The status is 'updated', 'unchanged', 'filtered',
+        'skipped' (no front matter) or 'error'.
+    """
+    kb_dir, relative_path, packed, options = task
+    try:
+        content = read_stored(kb_dir, relative_path)
+        if content is None:
+            raise FileNotFoundError(f"{relative_path} is no longer stored")
+        metadata, body = split_front_matter(content)
+        if not metadata:
+            return 'skipped', None
+
+        source_type = metadata.get('source_type')
+        if options['source_type'] and source_type != options['source_type']:
+            return 'filtered', None
+        if options['since'] or options['until']:
+            date_extracted = _parse_date(metadata.get('date_extracted'))
+            if date_extracted is None:
+                return 'filtered', None
+            if options['since'] and date_extracted < options['since']:
+                return 'filtered', None
+            if options['until'] and date_extracted > options['until']:
+                return 'filtered', None
+
+        body_hash = content_hash(body)
+        fingerprint = processor_fingerprint()
+        if (not options['force'] and metadata.get('processor_version') == fingerprint
+                and metadata.get('content_hash') == body_hash):
+            return 'unchanged', None
+
+        summary, extracted_keywords = analyze_text(text_for_analysis(body, source_type))
+        metadata['summary'] = summary
+        metadata['extracted_keywords'] = extracted_keywords
+        metadata['processor_version'] = fingerprint
+        metadata['content_hash'] = body_hash
+        # The body (including its leading blank line) is written back byte for byte
+        new_content = f"---\n{yaml.dump(metadata, sort_keys=False)}---\n{body}"
+        if not options['dry_run'] and not packed:
+            _write_atomic(os.path.join(kb_dir, relative_path), new_content)
+        return 'updated', new_content
+    except Exception as e:
+        print(f"Error reprocessing {relative_path}: {e}")
+        return 'error', None
+
+
+def _reprocess_task(task):
+    return task[1], task[2], _reprocess_item(task)
+
+
+def _resume_key(relative_path, packed):
+    """Position of an item in iter_stored_items order: every plain file comes before every pack-only item."""
+    return packed, walk_order_key(relative_path)
+
+
+def _read_checkpoint(checkpoint_path, run_key):
+    """(relative_path, packed) of the last item an interrupted run with run_key completed, or None."""
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if checkpoint.get('run') != run_key:
+        return None
+    if not checkpoint.get('last_path'):
+        return None
+    return checkpoint['last_path'], bool(checkpoint.get('packed'))
+
+
+def _write_checkpoint(checkpoint_path, run_key, last_path, packed):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'run': run_key, 'last_path': last_path, 'packed': packed}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def reprocess_knowledge_base(kb_dir, source_type=None, since=None, until=None, dry_run=False,
+                             force=False, restart=False, workers=None):
+    """
+    Regenerate `summary` and `extracted_keywords` for stored items without re-ingesting them.
+
+    Items of both storage backends are streamed in a stable order to a process pool. Plain files get
+    only their front matter rewritten, atomically; updated packed items are appended to the packs
+    again, where the latest append wins. Updated items are re-embedded in the vector index and, for
+    plain files, re-recorded in the manifest. Items whose body and processor fingerprint match what is recorded in their front matter
+    are left alone unless force is set. Every CHECKPOINT_EVERY items the path of the last completed one
+    is checkpointed, and an interrupted run with the same options resumes after it unless restart is
+    set; items added or removed in between do not shift the resume point. A dry run
+    does all the work except writing, which makes it a throughput benchmark.
+
+    Returns:
+        dict: Counts per outcome plus 'elapsed' seconds and 'items_per_second'.
+    """
+    options = {'source_type': source_type, 'since': since, 'until': until, 'dry_run': dry_run, 'force': force}
+    checkpoint_path = os.path.join(kb_dir, INDEX_DIRNAME, CHECKPOINT_FILE)
+    run_key = f"{processor_fingerprint()}|{source_type}|{since}|{until}|{force}"
+    resume_after = None if (restart or dry_run) else _read_checkpoint(checkpoint_path, run_key)
+    items = iter_stored_items(kb_dir)
+    if resume_after:
+        print(f"Resuming after {resume_after[0]} from {checkpoint_path}.")
+        resume_key = _resume_key(*resume_after)
+        items = dropwhile(lambda item: _resume_key(*item) <= resume_key, items)
+    if not dry_run:
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+
+    tasks = ((kb_dir, relative_path, packed, options) for relative_path, packed in items)
+    counts = Counter()
+    processed = 0
+    started = time.monotonic()
+    # These workers already use every core, so they analyze inline rather than through the NLP pool
+    with Pool(workers or os.cpu_count(), initializer=run_inline) as pool:
+        # imap keeps results in input order, so the last result's path is always a safe resume point
+        for relative_path, packed, (status, new_content) in pool.imap(_reprocess_task, tasks, chunksize=16):
+            if status == 'updated' and not dry_run:
+                if packed:
+                    pack_item(kb_dir, relative_path, new_content)
+                # The summary and keywords are part of what is embedded
+                index_document(kb_dir, relative_path, new_content)
+                if not packed:
+                    # The rewrite changed the file's size and mtime, which /browse compares with the manifest
+                    record_file(kb_dir, relative_path, new_content)
+            counts[status] += 1
+            processed += 1
+            if not dry_run and processed % CHECKPOINT_EVERY == 0:
+                _write_checkpoint(checkpoint_path, run_key, relative_path, packed)
+                print(f"Processed {processed} items...")
+
+    if not dry_run and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    elapsed = time.monotonic() - started
+    result = dict(counts)
+    result['elapsed'] = elapsed
+    result['items_per_second'] = processed / elapsed if elapsed > 0 else 0.0
+    return result
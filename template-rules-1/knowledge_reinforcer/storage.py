@@ -1,24 +1,160 @@
+import hashlib
 import os
 
+from .vector_index import index_document, indexed_paths, rename_documents
+from .corpus_stats import add_document
+from .pack_store import pack_item, read_packed
+from .manifest import load_rows, record_file, rename_files
+
 BASE_KNOWLEDGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'knowledge_base')
 
+CONTENT_TYPE_DIRS = {
+    "web-article": 'articles',
+    "youtube-video": 'videos',
+    "direct-text": 'direct_text',
+}
+
+# 'files' stores every item as its own markdown file; 'pack' appends items to compressed pack
+# files under .packs/ (see pack_store.py). Both backends use the same relative item paths.
+STORAGE_BACKEND = os.environ.get('KR_STORAGE_BACKEND', 'files')
+
+# Items are spread over 16 ** SHARD_PREFIX_LEN subdirectories per content type, named after the
+# leading hex digits of a hash of the filename (e.g. articles/3f/Some_Title_20240101_120000.md).
+# The shard is derived from the filename alone, so legacy flat paths can always be mapped.
+SHARD_PREFIX_LEN = 2
+
+# migrate_to_sharded updates the vector index and manifest after this many moves
+MIGRATE_BATCH = 1000
+
+def shard_for(filename):
+    return hashlib.md5(filename.encode('utf-8')).hexdigest()[:SHARD_PREFIX_LEN]
+
+def sharded_path(relative_path):
+    """Where an item of the old flat layout (e.g. articles/foo.md) lives in the sharded layout."""
+    directory, filename = os.path.split(relative_path)
+    return os.path.join(directory, shard_for(filename), filename)
+
+def is_inside(kb_dir, relative_path):
+    """Whether relative_path is a relative path that stays inside kb_dir once `..` and symlinks are resolved."""
+    if os.path.isabs(relative_path):
+        return False
+    base = os.path.realpath(kb_dir)
+    target = os.path.realpath(os.path.join(base, relative_path))
+    return os.path.commonpath([base, target]) == base
+
+def resolve_path(kb_dir, relative_path):
+    """
+    Map a relative item path, possibly from the old flat layout, to where the item is stored now.
+
+    Returns None if the item exists under neither layout, or if the path points outside kb_dir
+    (callers pass paths straight from URLs and API requests).
+    """
+    if not is_inside(kb_dir, relative_path):
+        return None
+    if os.path.isfile(os.path.join(kb_dir, relative_path)):
+        return relative_path
+    if os.path.isfile(os.path.join(kb_dir, sharded_path(relative_path))):
+        return sharded_path(relative_path)
+    return None
+
 def save_to_knowledge_base(filename, content, content_type):
-    target_dir = ""
-    if content_type == "web-article":
-        target_dir = os.path.join(BASE_KNOWLEDGE_DIR, 'articles')
-    elif content_type == "youtube-video":
-        target_dir = os.path.join(BASE_KNOWLEDGE_DIR, 'videos')
-    elif content_type == "direct-text":
-        target_dir = os.path.join(BASE_KNOWLEDGE_DIR, 'direct_text')
+    if content_type in CONTENT_TYPE_DIRS:
+        target_dir = os.path.join(BASE_KNOWLEDGE_DIR, CONTENT_TYPE_DIRS[content_type], shard_for(filename))
     else:
         target_dir = BASE_KNOWLEDGE_DIR # Fallback
 
-    os.makedirs(target_dir, exist_ok=True)
     file_path = os.path.join(target_dir, filename)
+    relative_path = os.path.relpath(file_path, BASE_KNOWLEDGE_DIR)
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        print(f"Saved: {file_path}")
+        if STORAGE_BACKEND == 'pack':
+            pack_item(BASE_KNOWLEDGE_DIR, relative_path, content)
+            print(f"Saved to packs: {relative_path}")
+        else:
+            os.makedirs(target_dir, exist_ok=True)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            print(f"Saved: {file_path}")
     except IOError as e:
         print(f"Error saving file {file_path}: {e}")
+        return None
+
+    try:
+        index_document(BASE_KNOWLEDGE_DIR, relative_path, content)
+        add_document(BASE_KNOWLEDGE_DIR, content)
+        if STORAGE_BACKEND != 'pack':
+            # Tells the watcher this file is already indexed
+            record_file(BASE_KNOWLEDGE_DIR, relative_path, content)
+    except Exception as e:
+        # The item is saved either way; `main.py --reindex` and `--rebuild-stats` can catch up later.
+        print(f"Error indexing {file_path}: {e}")
+    return relative_path
+
+def read_item(kb_dir, relative_path):
+    """
+    Return the markdown content of a stored item from either backend, or None if there is no such item.
+
+    Plain files win over packed copies, and legacy flat paths are resolved in both backends. Paths
+    pointing outside kb_dir are never read.
+    """
+    if not is_inside(kb_dir, relative_path):
+        return None
+    stored_path = resolve_path(kb_dir, relative_path)
+    if stored_path is not None:
+        with open(os.path.join(kb_dir, stored_path), 'r', encoding='utf-8') as f:
+            return f.read()
+    content = read_packed(kb_dir, relative_path)
+    if content is None:
+        content = read_packed(kb_dir, sharded_path(relative_path))
+    return content
+
+def _flat_paths_moved_to_shards(kb_dir, paths):
+    """Map the flat-layout paths among paths whose file is gone but whose sharded copy exists to that copy."""
+    type_dirs = set(CONTENT_TYPE_DIRS.values())
+    renames = {}
+    for path in paths:
+        directory, filename = os.path.split(path)
+        if directory not in type_dirs or os.path.exists(os.path.join(kb_dir, path)):
+            continue
+        if os.path.isfile(os.path.join(kb_dir, sharded_path(path))):
+            renames[path] = sharded_path(path)
+    return renames
+
+def _rename_indexed(kb_dir, renames):
+    if renames:
+        rename_documents(kb_dir, renames)
+        rename_files(kb_dir, renames)
+
+def migrate_to_sharded(kb_dir):
+    """
+    Move items of the old flat layout (e.g. articles/foo.md) into their shard directories, in place.
+
+    Safe to re-run: only files sitting directly in a content type directory are moved, and index
+    and manifest rows still pointing at files an interrupted run already moved are remapped first.
+    The vector index and manifest follow every MIGRATE_BATCH moves. A file whose shard path is
+    already taken is left where it is and reported. Returns the number of files moved.
+    """
+    _rename_indexed(kb_dir, _flat_paths_moved_to_shards(kb_dir, set(indexed_paths(kb_dir)) | set(load_rows(kb_dir))))
 
+    count = 0
+    batch = {}
+    for type_dir in CONTENT_TYPE_DIRS.values():
+        type_path = os.path.join(kb_dir, type_dir)
+        if not os.path.isdir(type_path):
+            continue
+        with os.scandir(type_path) as entries:
+            filenames = [entry.name for entry in entries if entry.is_file() and entry.name.endswith('.md')]
+        for filename in filenames:
+            shard = shard_for(filename)
+            target = os.path.join(type_path, shard, filename)
+            if os.path.exists(target):
+                print(f"Not moving {os.path.join(type_dir, filename)}: {os.path.join(type_dir, shard, filename)} already exists.")
+                continue
+            os.makedirs(os.path.join(type_path, shard), exist_ok=True)
+            os.rename(os.path.join(type_path, filename), target)
+            batch[os.path.join(type_dir, filename)] = os.path.join(type_dir, shard, filename)
+            count += 1
+            if len(batch) >= MIGRATE_BATCH:
+                _rename_indexed(kb_dir, batch)
+                batch = {}
+    _rename_indexed(kb_dir, batch)
+    return count
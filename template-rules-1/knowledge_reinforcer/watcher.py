@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Optional: without watchdog the watcher polls the tree instead
+    Observer = None
+    FileSystemEventHandler = object
+
+from .corpus_stats import rebuild_stats, update_document
+from .kb_utils import INDEX_DIRNAME, document_buckets
+from .manifest import describe, get_row, is_unchanged, load_buckets, load_rows, scan_changes, update_rows
+from .pack_store import PACKS_DIRNAME
+from .vector_index import index_document, remove_document
+
+DEBOUNCE_SECONDS = 1.0
+POLL_INTERVAL_SECONDS = 5.0
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        self.watcher.notify(event.src_path)
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self.watcher.notify(dest_path)
+
+
+class KnowledgeBaseWatcher:
+    """
+    Keeps the manifest, the vector index and the corpus statistics in sync with hand-edited files.
+
+    Changes are picked up through inotify (via watchdog) when available and by periodically
+    re-scanning the manifest otherwise. Events are debounced per file, so an editor's burst of
+    writes is handled once. Document frequencies are updated incrementally: the manifest keeps the
+    term buckets each file was counted with, so an edit replaces them and a delete subtracts them.
+    The first reconciliation of a tree with an empty manifest (or one written before buckets were
+    kept) recounts the statistics once with rebuild_stats instead, since items saved before may
+    already be counted.
+    """
+
+    def __init__(self, kb_dir, debounce=DEBOUNCE_SECONDS, poll_interval=POLL_INTERVAL_SECONDS, use_inotify=True):
+        self.kb_dir = os.path.abspath(kb_dir)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and Observer is not None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    def _relative_path(self, path):
+        relative_path = os.path.relpath(os.path.abspath(path), self.kb_dir)
+        top = relative_path.split(os.sep, 1)[0]
+        if top in (INDEX_DIRNAME, PACKS_DIRNAME, os.pardir) or not relative_path.endswith('.md'):
+            return None
+        return relative_path
+
+    def notify(self, path):
+        """Record a filesystem event for path; it is applied once the file has been quiet for `debounce` seconds."""
+        relative_path = self._relative_path(path)
+        if relative_path is None:
+            return
+        with self._lock:
+            self._pending[relative_path] = time.monotonic()
+
+    def _sync(self, relative_path, row, old_buckets, count=True):
+        """
+        Update the vector index and, if count is set, the corpus statistics for one file's current state.
+
+        old_buckets are the term buckets the file was last counted with, or None if it never was (or
+        its manifest row predates them, in which case the statistics are left alone).
+
+        Returns:
+            tuple: The manifest changes to make, as (rows to record, paths to remove) lists.
+        """
+        file_path = os.path.join(self.kb_dir, relative_path)
+        try:
+            stat = os.stat(file_path)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            if row is None:
+                return [], []
+            remove_document(self.kb_dir, relative_path)
+            if count and old_buckets is not None:
+                update_document(self.kb_dir, old_buckets, None)
+            print(f"Removed from index: {relative_path}")
+            return [], [relative_path]
+
+        # Events for writes the manifest already reflects (e.g. saves made by the app itself) are no-ops
+        if is_unchanged(row, stat):
+            return [], []
+        buckets = document_buckets(content)
+        index_document(self.kb_dir, relative_path, content)
+        if count and (row is None or old_buckets is not None):
+            update_document(self.kb_dir, old_buckets, buckets)
+        print(f"Indexed: {relative_path}")
+        return [describe(self.kb_dir, relative_path, content, buckets)], []
+
+    def apply(self, relative_path):
+        """Bring the manifest and search structures up to date with one file's current state."""
+        row = get_row(self.kb_dir, relative_path)
+        old_buckets = load_buckets(self.kb_dir, [relative_path]).get(relative_path) if row is not None else None
+        records, removed = self._sync(relative_path, row, old_buckets)
+        if records or removed:
+            update_rows(self.kb_dir, records, removed)
+
+    def _apply_safely(self, relative_path):
+        try:
+            self.apply(relative_path)
+        except Exception as e:
+            print(f"Error updating index for {relative_path}: {e}")
+
+    def reconcile(self):
+        """
+        Apply every change made while nobody was watching, found by comparing stat() with the manifest.
+
+        Manifest rows of the whole pass are written in one transaction at the end.
+        """
+        rows = load_rows(self.kb_dir)
+        recount = not rows or not all(row[4] for row in rows.values())
+        changed, removed = scan_changes(self.kb_dir, rows)
+        if recount:
+            # Files whose rows lack buckets are re-read too, so that every row has them after the recount
+            stale = set(changed) | set(removed)
+            changed += [path for path, row in rows.items() if not row[4] and path not in stale]
+            old_buckets = {}
+        else:
+            old_buckets = load_buckets(self.kb_dir, [path for path in changed + removed if path in rows])
+        records, forgotten = [], []
+        removed_set = set(removed)
+        for relative_path in changed + removed:
+            # While recounting, existing files are recorded afresh whatever their row says
+            row = None if recount and relative_path not in removed_set else rows.get(relative_path)
+            try:
+                recorded, gone = self._sync(relative_path, row, old_buckets.get(relative_path), count=not recount)
+            except Exception as e:
+                print(f"Error updating index for {relative_path}: {e}")
+                continue
+            records.extend(recorded)
+            forgotten.extend(gone)
+        update_rows(self.kb_dir, records, forgotten)
+        if recount and records:
+            rebuild_stats(self.kb_dir)
+        return len(changed), len(removed)
+
+    def flush(self, force=False):
+        """Apply pending events older than the debounce period (all of them if force is set)."""
+        now = time.monotonic()
+        with self._lock:
+            due = [path for path, last in self._pending.items() if force or now - last >= self.debounce]
+            for path in due:
+                del self._pending[path]
+        for relative_path in due:
+            self._apply_safely(relative_path)
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stop.wait(min(0.2, self.debounce)):
+            self.flush()
+            if not self.use_inotify and time.monotonic() >= next_poll:
+                self.reconcile()
+                next_poll = time.monotonic() + self.poll_interval
+
+    def start(self):
+        os.makedirs(self.kb_dir, exist_ok=True)
+        changed, removed = self.reconcile()
+        print(f"Startup reconciliation: {changed} changed, {removed} removed.")
+        if self.use_inotify:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_EventHandler(self), self.kb_dir, recursive=True)
+                self._observer.start()
+            except OSError as e:
+                print(f"Could not watch {self.kb_dir} with inotify ({e}). Falling back to polling.")
+                self._observer = None
+                self.use_inotify = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush(force=True)
+
+
+def run_watcher(kb_dir):
+    """Watch kb_dir until interrupted (Ctrl+C)."""
+    watcher = KnowledgeBaseWatcher(kb_dir)
+    watcher.start()
+    mode = "inotify" if watcher.use_inotify else f"polling every {watcher.poll_interval:.0f}s"
+    print(f"Watching {watcher.kb_dir} ({mode}). Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
@@ -1,32 +1,50 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
+from werkzeug.exceptions import RequestEntityTooLarge
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from bs4 import BeautifulSoup
+import gzip
+import json
 import os
 import sys
+import uuid
 import yaml
 import re
+import zlib
 
 # Add the parent directory to the sys.path to allow relative imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from knowledge_reinforcer.fetcher import fetch_content
 from knowledge_reinforcer.processor import process_content_to_markdown
-from knowledge_reinforcer.storage import save_to_knowledge_base, BASE_KNOWLEDGE_DIR
+from knowledge_reinforcer.storage import save_to_knowledge_base, read_item, resolve_path, sharded_path, BASE_KNOWLEDGE_DIR
+from knowledge_reinforcer.pack_store import iter_stored_items, packed_items, read_stored
+from knowledge_reinforcer.kb_utils import split_front_matter
+from knowledge_reinforcer.manifest import list_items
+from knowledge_reinforcer.job_store import create_jobs, update_job, get_jobs
+from knowledge_reinforcer.vector_index import find_related
 
 app = Flask(__name__, template_folder='templates')
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'a_very_dev_default_secret_key_for_flask_app_kb_project_v2') # Unique default key
 
+# JSON API limits and background ingestion
+MAX_BULK_ITEMS = 1000
+MAX_REQUEST_BYTES = 32 * 1024 * 1024 # Request bodies as sent, compressed or not
+MAX_JSON_BYTES = 64 * 1024 * 1024 # JSON bodies after gzip decompression
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+_ingest_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('KR_INGEST_WORKERS', 4)))
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/process_input', methods=['POST'])
-def process_input():
-    url = request.form.get('url')
-    text = request.form.get('text')
-    tags = request.form.get('tags', '')
-    purpose = request.form.get('purpose', '')
+def _ingest(url, text, tags, purpose, filename_suffix=''):
+    """
+    Fetch (for a URL), process and save one item.
 
+    Returns:
+        str: The saved item's relative path. Raises ValueError with a user-facing message on failure.
+    """
     content_type = None
     raw_content = None
     source_url = None
@@ -44,61 +62,65 @@ def process_input():
             title = fetched_title
         
         if not raw_content:
-            return f"Error: Could not fetch content from {url}.", 400
+            raise ValueError(f"Could not fetch content from {url}.")
 
     elif text:
         content_type = "direct-text"
         raw_content = text
         title = f"Direct Text - {datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
-    if raw_content:
-        markdown_content = process_content_to_markdown(
-            raw_content,
-            content_type,
-            source_url,
-            title,
-            tags.split(',') if tags else [],
-            purpose
+    if not raw_content:
+        raise ValueError("No content provided.")
+
+    markdown_content = process_content_to_markdown(
+        raw_content,
+        content_type,
+        source_url,
+        title,
+        tags.split(',') if tags else [],
+        purpose
+    )
+    if not markdown_content:
+        raise ValueError("Could not process content to markdown.")
+
+    filename_base = re.sub(r'[^a-zA-Z0-9_]', '', title.replace(' ', '_'))[:50] or "untitled"
+    filename = f"{filename_base}_{datetime.now().strftime('%Y%m%2d_%H%M%S')}{filename_suffix}.md"
+    return save_to_knowledge_base(filename, markdown_content, content_type)
+
+@app.route('/process_input', methods=['POST'])
+def process_input():
+    try:
+        _ingest(
+            request.form.get('url'),
+            request.form.get('text'),
+            request.form.get('tags', ''),
+            request.form.get('purpose', '')
         )
-        if markdown_content:
-            filename_base = re.sub(r'[^a-zA-Z0-9_]', '', title.replace(' ', '_'))[:50] or "untitled"
-            filename = f"{filename_base}_{datetime.now().strftime('%Y%m%2d_%H%M%S')}.md"
-            save_to_knowledge_base(filename, markdown_content, content_type)
-            flash("Content saved successfully!", 'success')
-            return redirect(url_for('index'))
-        else:
-            return "Error: Could not process content to markdown.", 400
-    return "Error: No content provided.", 400
+    except ValueError as e:
+        return f"Error: {e}", 400
+    flash("Content saved successfully!", 'success')
+    return redirect(url_for('index'))
 
 @app.route('/browse')
 def browse():
     knowledge_items = []
-    for root, _, files in os.walk(BASE_KNOWLEDGE_DIR):
-        for file in files:
-            if file.endswith('.md'):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                metadata = {}
-                parts = content.split('---\n', 2)
-                if len(parts) > 1:
-                    try:
-                        metadata = yaml.safe_load(parts[1])
-                    except yaml.YAMLError as e:
-                        print(f"Error parsing YAML in {file}: {e}")
-
-                title = metadata.get('title', file.replace('.md', ''))
-                date_extracted_str = metadata.get('date_extracted')
-                date_extracted = datetime.fromisoformat(date_extracted_str) if date_extracted_str else datetime.min
-
-                relative_path = os.path.relpath(file_path, BASE_KNOWLEDGE_DIR)
-                knowledge_items.append({
-                    'filename': relative_path,
-                    'title': title,
-                    'date': date_extracted
-                })
-    
+    # The manifest holds title and date of every indexed file, so only changed files get parsed here
+    for relative_path, (title, date_extracted_str) in list_items(BASE_KNOWLEDGE_DIR).items():
+        knowledge_items.append({
+            'filename': relative_path,
+            'title': title or os.path.basename(relative_path).replace('.md', ''),
+            'date': datetime.fromisoformat(date_extracted_str) if date_extracted_str else datetime.min
+        })
+
+    # Packed items are listed straight from the pack index, without decompressing them
+    for entry in packed_items(BASE_KNOWLEDGE_DIR):
+        date_extracted_str = entry.get('date_extracted')
+        knowledge_items.append({
+            'filename': entry['path'],
+            'title': entry.get('title') or os.path.basename(entry['path']).replace('.md', ''),
+            'date': datetime.fromisoformat(date_extracted_str) if date_extracted_str else datetime.min
+        })
+
     # Sort by date, newest first
     knowledge_items.sort(key=lambda x: x['date'], reverse=True)
 
@@ -106,13 +128,11 @@ def browse():
 
 @app.route('/view/<path:filename>')
 def view_file(filename):
-    file_path = os.path.join(BASE_KNOWLEDGE_DIR, filename)
-    if not os.path.exists(file_path):
+    # Works for plain files, packed items and pre-sharding links such as articles/foo.md
+    content = read_item(BASE_KNOWLEDGE_DIR, filename)
+    if content is None:
         return "File not found", 404
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
     # Separate YAML front matter from content
     parts = content.split('---\n', 2)
     if len(parts) > 2:
@@ -129,6 +149,21 @@ def view_file(filename):
 
     return render_template('view.html', content=html_content, metadata=metadata, filename=filename)
 
+@app.route('/related/<path:filename>')
+def related(filename):
+    top_k = request.args.get('top_k', 5, type=int)
+    stored_path = resolve_path(BASE_KNOWLEDGE_DIR, filename) or filename
+    matches = find_related(BASE_KNOWLEDGE_DIR, stored_path, top_k)
+    if matches is None:
+        # Packed items have no file to resolve a pre-sharding link against
+        matches = find_related(BASE_KNOWLEDGE_DIR, sharded_path(filename), top_k)
+    if matches is None:
+        return "File not indexed", 404
+    return jsonify({
+        'filename': filename,
+        'related': [{'filename': path, 'score': round(score, 4)} for path, score in matches]
+    })
+
 @app.route('/analyze_content', methods=['POST'])
 def analyze_content():
     url = request.json.get('url')
@@ -164,16 +199,149 @@ def analyze_content():
         from .processor import _clean_text
         plain_text_content = _clean_text(plain_text_content)
         # Generate summary (purpose) and keywords (tags)
-        from .processor import _generate_summary, _extract_keywords
-        auto_purpose = _generate_summary(plain_text_content)
+        from .processor import analyze_text
+        auto_purpose, keywords = analyze_text(plain_text_content)
         if auto_purpose:
             auto_purpose = "Relevant for AI coding: " + auto_purpose
-        auto_tags = ', '.join(_extract_keywords(plain_text_content))
+        auto_tags = ', '.join(keywords)
         print(f"Generated Purpose: {auto_purpose}")
         print(f"Generated Tags: {auto_tags}")
         return jsonify({'purpose': auto_purpose, 'tags': auto_tags})
     
     return jsonify({'purpose': '', 'tags': ''})
 
+# --- JSON API ---
+# Request bodies may be sent gzip-compressed (Content-Encoding: gzip), and responses are
+# gzip-compressed for clients that send Accept-Encoding: gzip. Bodies larger than
+# MAX_REQUEST_BYTES, or than MAX_JSON_BYTES once decompressed, are rejected with 413.
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    if request.path.startswith('/api/'):
+        return _json_response({'error': f"Request bodies are limited to {MAX_REQUEST_BYTES} bytes, "
+                                        f"or {MAX_JSON_BYTES} bytes once decompressed."}, 413)
+    return e
+
+def _json_body():
+    data = request.get_data()
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        # Decompress at most one byte past the cap, so a small gzip bomb cannot exhaust memory
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            data = decompressor.decompress(data, MAX_JSON_BYTES + 1)
+        except zlib.error:
+            return None
+        if len(data) > MAX_JSON_BYTES:
+            raise RequestEntityTooLarge()
+        if not decompressor.eof:
+            return None
+    try:
+        return json.loads(data or b'null')
+    except ValueError:
+        return None
+
+def _accepts_gzip():
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+def _json_response(payload, status=200):
+    body = json.dumps(payload, default=str).encode('utf-8')
+    response = Response(body, status=status, mimetype='application/json')
+    if _accepts_gzip():
+        response.set_data(gzip.compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def _bulk_list(key, strings=False):
+    payload = _json_body()
+    values = payload.get(key) if isinstance(payload, dict) else None
+    if not isinstance(values, list) or not values:
+        return None, _json_response({'error': f"Expected a JSON object with a non-empty '{key}' list."}, 400)
+    if len(values) > MAX_BULK_ITEMS:
+        return None, _json_response({'error': f"At most {MAX_BULK_ITEMS} {key} per request."}, 400)
+    if strings and not all(isinstance(value, str) for value in values):
+        return None, _json_response({'error': f"Every entry of '{key}' must be a string."}, 400)
+    return values, None
+
+def _run_ingest_job(kb_dir, job_id, item):
+    update_job(kb_dir, job_id, 'running')
+    tags = item.get('tags') or ''
+    if isinstance(tags, list):
+        tags = ','.join(tags)
+    try:
+        # The job id suffix keeps items ingested in the same second from overwriting each other
+        path = _ingest(item.get('url'), item.get('text'), tags, item.get('purpose', ''), filename_suffix=f"_{job_id[:8]}")
+        update_job(kb_dir, job_id, 'done', path=path)
+    except ValueError as e:
+        update_job(kb_dir, job_id, 'failed', error=str(e))
+    except Exception as e:
+        print(f"Error in ingest job {job_id}: {e}")
+        update_job(kb_dir, job_id, 'failed', error=f"Unexpected error: {e}")
+
+@app.route('/api/ingest', methods=['POST'])
+def api_ingest():
+    items, error = _bulk_list('items')
+    if error:
+        return error
+
+    jobs, queued = [], []
+    for item in items:
+        job_id = uuid.uuid4().hex
+        if not isinstance(item, dict) or not (item.get('url') or item.get('text')):
+            jobs.append((job_id, 'failed', "Each item needs a 'url' or a 'text'."))
+        else:
+            jobs.append((job_id, 'queued', None))
+            queued.append((job_id, item))
+    # Record every job before submitting any, so a worker never updates a job that does not exist yet
+    create_jobs(BASE_KNOWLEDGE_DIR, jobs)
+    for job_id, item in queued:
+        _ingest_executor.submit(_run_ingest_job, BASE_KNOWLEDGE_DIR, job_id, item)
+    job_ids = [job_id for job_id, _, _ in jobs]
+    return _json_response({'jobs': job_ids}, 202)
+
+@app.route('/api/jobs', methods=['POST'])
+def api_jobs():
+    job_ids, error = _bulk_list('ids', strings=True)
+    if error:
+        return error
+    return _json_response({'jobs': get_jobs(BASE_KNOWLEDGE_DIR, job_ids)})
+
+@app.route('/api/metadata', methods=['POST'])
+def api_metadata():
+    paths, error = _bulk_list('paths', strings=True)
+    if error:
+        return error
+    items = {}
+    for path in paths:
+        content = read_item(BASE_KNOWLEDGE_DIR, path)
+        items[path] = split_front_matter(content)[0] if content is not None else None
+    return _json_response({'items': items})
+
+def _export_lines(kb_dir):
+    for relative_path, _ in iter_stored_items(kb_dir):
+        content = read_stored(kb_dir, relative_path)
+        if content is None:
+            continue
+        metadata, body = split_front_matter(content)
+        yield json.dumps({'path': relative_path, 'metadata': metadata, 'body': body}, default=str).encode('utf-8') + b'\n'
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/api/export')
+def api_export():
+    """Stream every item as NDJSON, one {"path", "metadata", "body"} object per line."""
+    lines = _export_lines(BASE_KNOWLEDGE_DIR)
+    response = Response(_gzip_stream(lines) if _accepts_gzip() else lines, mimetype='application/x-ndjson')
+    if _accepts_gzip():
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True, port=3000)
\ No newline at end of file
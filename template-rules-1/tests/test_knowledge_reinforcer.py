@@ -1,18 +1,36 @@
 import pytest
 import sys
 import os
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 import requests # Added import
 import tempfile
 import shutil
+import gzip
+import itertools
+import json
+import sqlite3
+import asyncio
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
 
 # Add the parent directory to the sys.path to allow imports from knowledge_reinforcer
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from knowledge_reinforcer.processor import _generate_summary, _extract_keywords
+from knowledge_reinforcer.processor import _generate_summary, _extract_keywords, processor_fingerprint
 from knowledge_reinforcer.fetcher import fetch_content
 from knowledge_reinforcer.web_app import app # Import the Flask app
-from knowledge_reinforcer.storage import BASE_KNOWLEDGE_DIR, save_to_knowledge_base
+from knowledge_reinforcer.storage import BASE_KNOWLEDGE_DIR, save_to_knowledge_base, migrate_to_sharded, read_item, resolve_path, shard_for
+from knowledge_reinforcer import pack_store
+from knowledge_reinforcer.crawler import BloomFilter, crawl, save_page
+from knowledge_reinforcer.watcher import KnowledgeBaseWatcher
+from knowledge_reinforcer import manifest
+from knowledge_reinforcer import nlp_pool
+from knowledge_reinforcer.analysis_cache import AnalysisCache
+from knowledge_reinforcer import vector_index, corpus_stats, web_app, job_store, crawler
+from knowledge_reinforcer.reprocess import reprocess_knowledge_base
+from knowledge_reinforcer.kb_utils import iter_markdown_files, split_front_matter
 
 @pytest.fixture
 def client():
@@ -193,4 +211,710 @@ def test_view_file_route_success(client, temp_knowledge_base):
 def test_view_file_route_not_found(client, temp_knowledge_base):
     response = client.get('/view/nonexistent_file.md')
     assert response.status_code == 404
-    assert b"File not found" in response.data
\ No newline at end of file
+    assert b"File not found" in response.data
+
+# Tests for vector_index
+PYTHON_DOC = "---\ntitle: Python decorators\n---\n\nPython decorators wrap functions. Decorators in Python modify function behaviour."
+PYTHON_DOC_2 = "---\ntitle: Writing decorators\n---\n\nA decorator is a Python function that wraps another function to modify behaviour."
+GARDEN_DOC = "---\ntitle: Tomatoes\n---\n\nTomato plants need sunlight, compost and regular watering in the garden."
+
+def test_save_indexes_and_finds_related(temp_knowledge_base):
+    python_path = save_to_knowledge_base('python.md', PYTHON_DOC, 'direct-text')
+    save_to_knowledge_base('garden.md', GARDEN_DOC, 'direct-text')
+    python2_path = save_to_knowledge_base('python2.md', PYTHON_DOC_2, 'direct-text')
+
+    matches = vector_index.find_related(temp_knowledge_base, python_path)
+    assert matches[0][0] == python2_path
+    assert all(path != python_path for path, _ in matches)
+
+def test_cli_query_finds_items_by_free_text(temp_knowledge_base, mocker, capsys):
+    from knowledge_reinforcer import main as cli
+    garden_path = save_to_knowledge_base('garden.md', GARDEN_DOC, 'direct-text')
+    save_to_knowledge_base('python.md', PYTHON_DOC, 'direct-text')
+    mocker.patch.object(cli, 'BASE_KNOWLEDGE_DIR', temp_knowledge_base)
+    mocker.patch.object(cli, 'ensure_nltk_resources')
+    mocker.patch.object(sys, 'argv', ['main.py', '--query', 'watering tomato plants', '--top-k', '1'])
+    capsys.readouterr()
+    cli.main()
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert len(lines) == 1 and lines[0].endswith(garden_path)
+
+def _unit(rows):
+    return (rows / np.linalg.norm(rows, axis=-1, keepdims=True)).astype(np.float32)
+
+def test_ivf_search_finds_near_neighbours_in_large_indexes(temp_knowledge_base):
+    rng = np.random.default_rng(0)
+    num_rows = vector_index.BRUTE_FORCE_LIMIT + 5000
+    queries = _unit(rng.standard_normal((200, vector_index.VECTOR_DIM)))
+    neighbours = {}
+    for cosine in (0.8, 0.6):
+        # Unit vectors at exactly this cosine from each query
+        noise = rng.standard_normal(queries.shape)
+        noise = _unit(noise - (noise * queries).sum(axis=1, keepdims=True) * queries)
+        neighbours[cosine] = _unit(cosine * queries + np.sqrt(1 - cosine ** 2) * noise)
+    paths = [f"random/{i}.md" for i in range(num_rows)]
+    paths += [f"near{cosine}/{i}.md" for cosine in neighbours for i in range(len(queries))]
+    rows = np.vstack([_unit(rng.standard_normal((num_rows, vector_index.VECTOR_DIM)))] + list(neighbours.values()))
+    index = vector_index.get_index(temp_knowledge_base)
+    index.replace_all(paths, rows)
+    assert index.centroids() is not None
+
+    for cosine, minimum_recall in ((0.8, 0.95), (0.6, 0.85)):
+        found = sum(f"near{cosine}/{i}.md" in [path for path, _ in index.search(query, top_k=10)]
+                    for i, query in enumerate(queries))
+        assert found / len(queries) >= minimum_recall
+
+    # Items saved after the lists were fitted are assigned to one and found
+    vector_index.index_document(temp_knowledge_base, 'late.md', PYTHON_DOC)
+    vector_index.index_document(temp_knowledge_base, 'late2.md', PYTHON_DOC)
+    assert vector_index.find_related(temp_knowledge_base, 'late.md', top_k=1)[0][0] == 'late2.md'
+
+TOPIC_WORDS = {
+    'car': "car automobile vehicle engine wheels driver road fuel brakes gearbox".split(),
+    'garden': "garden tomato compost soil watering seeds sunlight harvest weeds greenhouse".split(),
+    'python': "python function decorator class module import generator iterator exception lambda".split(),
+}
+
+def _write_topic_notes(kb_dir, per_topic=16):
+    import random
+    rng = random.Random(3)
+    os.makedirs(os.path.join(kb_dir, 'notes'), exist_ok=True)
+    for topic, words in TOPIC_WORDS.items():
+        for i in range(per_topic):
+            with open(os.path.join(kb_dir, 'notes', f"{topic}{i}.md"), 'w', encoding='utf-8') as f:
+                f.write(f"---\ntitle: Note\n---\n\n{' '.join(rng.sample(words, 5))} notes about the topic today\n")
+
+def test_rebuild_index_relates_items_by_meaning(temp_knowledge_base):
+    _write_topic_notes(temp_knowledge_base)
+    assert vector_index.rebuild_index(temp_knowledge_base) == 50
+    assert vector_index.get_index(temp_knowledge_base).projection() is not None
+
+    matches = vector_index.query_related(temp_knowledge_base, "automobile", top_k=10)
+    assert len(matches) == 10
+    assert all(os.path.basename(path).startswith('car') for path, _ in matches)
+    # Car notes that never mention "automobile" are found through the words they share with those that do
+    assert any('automobile' not in read_item(temp_knowledge_base, path) for path, _ in matches)
+
+    # Items saved after the fit are projected the same way
+    saved_path = save_to_knowledge_base('brakes.md', "---\ntitle: Brakes\n---\n\nThe driver checks the brakes and fuel.", 'direct-text')
+    assert os.path.basename(vector_index.find_related(temp_knowledge_base, saved_path, top_k=1)[0][0]).startswith('car')
+
+def test_remove_document_drops_it_from_results(temp_knowledge_base):
+    vector_index.index_document(temp_knowledge_base, 'a.md', PYTHON_DOC)
+    vector_index.index_document(temp_knowledge_base, 'b.md', PYTHON_DOC_2)
+    assert vector_index.remove_document(temp_knowledge_base, 'b.md')
+
+    assert vector_index.find_related(temp_knowledge_base, 'a.md') == []
+    assert vector_index.find_related(temp_knowledge_base, 'b.md') is None
+
+def test_related_route(client, temp_knowledge_base):
+    vector_index.rebuild_index(temp_knowledge_base)
+    response = client.get('/related/articles/test_article.md')
+    assert response.status_code == 200
+    assert response.get_json()['related'][0]['filename'] == os.path.join('direct_text', 'test_text.md')
+
+    response = client.get('/related/articles/missing.md')
+    assert response.status_code == 404
+
+# Tests for corpus_stats
+def test_corpus_stats_idf_favours_rare_terms(temp_knowledge_base):
+    assert corpus_stats.load_stats(temp_knowledge_base) is None
+    save_to_knowledge_base('python.md', PYTHON_DOC, 'direct-text')
+    save_to_knowledge_base('python2.md', PYTHON_DOC_2, 'direct-text')
+    save_to_knowledge_base('garden.md', GARDEN_DOC, 'direct-text')
+
+    stats = corpus_stats.load_stats(temp_knowledge_base)
+    assert stats.num_docs == 3
+    assert stats.idf('tomato') > stats.idf('python')
+    assert stats.idf('unseenterm') > stats.idf('tomato')
+
+def test_rebuild_stats_matches_incremental_counts(temp_knowledge_base):
+    save_to_knowledge_base('python.md', PYTHON_DOC, 'direct-text')
+    save_to_knowledge_base('garden.md', GARDEN_DOC, 'direct-text')
+    incremental = np.array(corpus_stats.load_stats(temp_knowledge_base).doc_freq)
+
+    # The fixture's two pre-existing files are only picked up by the rebuild
+    assert corpus_stats.rebuild_stats(temp_knowledge_base, workers=2) == 4
+    rebuilt = corpus_stats.load_stats(temp_knowledge_base)
+    assert rebuilt.num_docs == 4
+    assert (rebuilt.doc_freq >= incremental).all()
+    assert rebuilt.idf('content') < rebuilt.idf('tomato')
+
+def test_add_document_counts_concurrent_saves(temp_knowledge_base):
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: corpus_stats.add_document(temp_knowledge_base, PYTHON_DOC), range(200)))
+
+    stats = corpus_stats.load_stats(temp_knowledge_base)
+    assert stats.num_docs == 200
+    assert stats.doc_freq[corpus_stats.term_bucket('python')] == 200
+
+def test_rebuild_stats_keeps_saves_made_during_the_pass(temp_knowledge_base, mocker):
+    class SavingPool:
+        """Runs in-process, and a save lands while the items are being counted."""
+        def __init__(self, workers):
+            pass
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc_info):
+            return False
+        def imap_unordered(self, func, tasks, chunksize):
+            corpus_stats.add_document(temp_knowledge_base, GARDEN_DOC)
+            return map(func, tasks)
+
+    mocker.patch.object(corpus_stats, 'Pool', SavingPool)
+    assert corpus_stats.rebuild_stats(temp_knowledge_base) == 3
+    stats = corpus_stats.load_stats(temp_knowledge_base)
+    assert stats.num_docs == 3
+    assert stats.doc_freq[corpus_stats.term_bucket('garden')] == 1
+    assert not os.path.exists(os.path.join(temp_knowledge_base, '.index', corpus_stats.JOURNAL_FILE))
+    # Without a rebuild running, saves are not journaled
+    corpus_stats.add_document(temp_knowledge_base, GARDEN_DOC)
+    assert not os.path.exists(os.path.join(temp_knowledge_base, '.index', corpus_stats.JOURNAL_FILE))
+
+# Tests for reprocess
+def test_reprocess_rewrites_front_matter_only(temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.reprocess.analyze_text', return_value=("New summary.", ["new keyword"]))
+    article_path = os.path.join(temp_knowledge_base, 'articles', 'test_article.md')
+
+    result = reprocess_knowledge_base(temp_knowledge_base, workers=2)
+    assert result['updated'] == 2
+
+    with open(article_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    metadata, body = split_front_matter(content)
+    assert metadata['title'] == "Test Article"
+    assert metadata['summary'] == "New summary."
+    assert metadata['extracted_keywords'] == ["new keyword"]
+    assert body == "\nContent of test article."
+    # The vector index and the manifest reflect the rewritten files
+    index = vector_index.get_index(temp_knowledge_base)
+    _, vector = index.vector_for(os.path.join('articles', 'test_article.md'))
+    np.testing.assert_allclose(vector, index.embed(vector_index.document_text(content)), atol=1e-6)
+    assert manifest.scan_changes(temp_knowledge_base) == ([], [])
+
+    # Nothing changed since, so a second run skips everything
+    result = reprocess_knowledge_base(temp_knowledge_base, workers=2)
+    assert result.get('updated', 0) == 0
+    assert result['unchanged'] == 2
+
+def test_reprocess_filters_and_dry_run(temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.reprocess.analyze_text', return_value=("New summary.", []))
+    relative_path = save_to_knowledge_base('typed.md', "---\ntitle: Typed\nsource_type: web-article\n---\n\nBody.", 'web-article')
+    typed_path = os.path.join(temp_knowledge_base, relative_path)
+    with open(typed_path, 'r', encoding='utf-8') as f:
+        before = f.read()
+
+    result = reprocess_knowledge_base(temp_knowledge_base, source_type='web-article', dry_run=True, workers=2)
+    assert result['updated'] == 1
+    assert result['filtered'] == 2
+    assert result['items_per_second'] > 0
+    with open(typed_path, 'r', encoding='utf-8') as f:
+        assert f.read() == before
+
+def test_reprocess_resumes_from_checkpoint(temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.reprocess.analyze_text', return_value=("New summary.", []))
+    mocker.patch('knowledge_reinforcer.reprocess.CHECKPOINT_EVERY', 1)
+    # Keep the checkpoint of the first run, as if it had been interrupted
+    with patch('knowledge_reinforcer.reprocess.os.remove'):
+        reprocess_knowledge_base(temp_knowledge_base, source_type='direct-text', workers=1)
+
+    result = reprocess_knowledge_base(temp_knowledge_base, source_type='direct-text', workers=1)
+    assert sum(v for k, v in result.items() if k not in ('elapsed', 'items_per_second')) == 0
+    assert not os.path.exists(os.path.join(temp_knowledge_base, '.index', 'reprocess_checkpoint.json'))
+
+def test_reprocess_resumes_after_last_path_when_files_change(temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.reprocess.analyze_text', return_value=("New summary.", []))
+    for name in ('a.md', 'b.md', 'c.md', 'd.md'):
+        with open(os.path.join(temp_knowledge_base, 'direct_text', name), 'w') as f:
+            f.write(f"---\ntitle: {name}\n---\n\nContent of {name}.")
+    checkpoint_path = os.path.join(temp_knowledge_base, '.index', 'reprocess_checkpoint.json')
+    os.makedirs(os.path.dirname(checkpoint_path))
+    run_key = f"{processor_fingerprint()}|None|None|None|False"
+    with open(checkpoint_path, 'w') as f:
+        json.dump({'run': run_key, 'last_path': os.path.join('direct_text', 'b.md')}, f)
+    # Items appearing or disappearing before the resume point must not shift it
+    os.remove(os.path.join(temp_knowledge_base, 'direct_text', 'a.md'))
+    os.makedirs(os.path.join(temp_knowledge_base, 'articles', 'new'))
+    with open(os.path.join(temp_knowledge_base, 'articles', 'new', 'added.md'), 'w') as f:
+        f.write("---\ntitle: Added\n---\n\nAdded after the checkpoint.")
+
+    result = reprocess_knowledge_base(temp_knowledge_base, workers=1)
+    assert result['updated'] == 3
+    updated = sorted(os.path.relpath(path, temp_knowledge_base) for path in iter_markdown_files(temp_knowledge_base)
+                     if 'New summary.' in open(path, encoding='utf-8').read())
+    assert updated == [os.path.join('direct_text', name) for name in ('c.md', 'd.md', 'test_text.md')]
+
+# Tests for the sharded storage layout
+def test_save_uses_shard_directory(temp_knowledge_base):
+    relative_path = save_to_knowledge_base('note.md', "Some note.", 'direct-text')
+    assert relative_path == os.path.join('direct_text', shard_for('note.md'), 'note.md')
+    assert os.path.isfile(os.path.join(temp_knowledge_base, relative_path))
+    assert resolve_path(temp_knowledge_base, os.path.join('direct_text', 'note.md')) == relative_path
+
+def test_migrate_to_sharded_keeps_links_working(client, temp_knowledge_base):
+    vector_index.rebuild_index(temp_knowledge_base)
+    assert migrate_to_sharded(temp_knowledge_base) == 2
+    assert migrate_to_sharded(temp_knowledge_base) == 0
+
+    sharded_path = os.path.join('articles', shard_for('test_article.md'), 'test_article.md')
+    assert os.path.isfile(os.path.join(temp_knowledge_base, sharded_path))
+    assert not os.path.exists(os.path.join(temp_knowledge_base, 'articles', 'test_article.md'))
+
+    response = client.get('/related/articles/test_article.md')
+    assert response.status_code == 200
+    assert response.get_json()['related'][0]['filename'] == os.path.join('direct_text', shard_for('test_text.md'), 'test_text.md')
+    assert resolve_path(temp_knowledge_base, 'articles/missing.md') is None
+
+def test_migrate_to_sharded_recovers_interrupted_runs(client, temp_knowledge_base, capsys):
+    vector_index.rebuild_index(temp_knowledge_base)
+    KnowledgeBaseWatcher(temp_knowledge_base, use_inotify=False).reconcile()
+    # An interrupted run moved this file but never updated the index or the manifest
+    flat_path = os.path.join('articles', 'test_article.md')
+    moved_path = os.path.join('articles', shard_for('test_article.md'), 'test_article.md')
+    os.makedirs(os.path.dirname(os.path.join(temp_knowledge_base, moved_path)))
+    os.rename(os.path.join(temp_knowledge_base, flat_path), os.path.join(temp_knowledge_base, moved_path))
+    # And a flat file whose shard path is already taken must not overwrite it
+    taken_path = os.path.join('direct_text', shard_for('test_text.md'), 'test_text.md')
+    os.makedirs(os.path.dirname(os.path.join(temp_knowledge_base, taken_path)))
+    with open(os.path.join(temp_knowledge_base, taken_path), 'w') as f:
+        f.write("---\ntitle: Already Sharded\n---\n\nKeep me.")
+
+    assert migrate_to_sharded(temp_knowledge_base) == 0
+    assert "direct_text/test_text.md" in capsys.readouterr().out.replace(os.sep, '/')
+    with open(os.path.join(temp_knowledge_base, taken_path)) as f:
+        assert "Keep me." in f.read()
+    assert os.path.isfile(os.path.join(temp_knowledge_base, 'direct_text', 'test_text.md'))
+    assert vector_index.find_related(temp_knowledge_base, moved_path) is not None
+    assert manifest.get_row(temp_knowledge_base, moved_path) is not None
+    assert manifest.get_row(temp_knowledge_base, flat_path) is None
+    assert client.get('/related/articles/test_article.md').status_code == 200
+
+# Tests for the pack storage backend
+def test_pack_backend_round_trip(client, temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.storage.STORAGE_BACKEND', 'pack')
+    transcript = "---\ntitle: Long Talk\ndate_extracted: '2024-01-02T03:04:05'\n---\n\n" + "talk transcript " * 2000
+    relative_path = save_to_knowledge_base('talk.md', transcript, 'youtube-video')
+    save_to_knowledge_base('other.md', GARDEN_DOC, 'direct-text')
+
+    assert not os.path.exists(os.path.join(temp_knowledge_base, relative_path))
+    pack_file = os.path.join(temp_knowledge_base, pack_store.PACKS_DIRNAME, 'pack-00000.pack')
+    assert os.path.getsize(pack_file) < len(transcript) // 10
+    assert read_item(temp_knowledge_base, relative_path) == transcript
+    assert vector_index.find_related(temp_knowledge_base, relative_path) is not None
+
+    response = client.get('/browse')
+    assert b"Long Talk" in response.data
+    assert b"articles/test_article.md" in response.data
+
+def test_pack_backend_serves_pre_sharding_links(client, temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.storage.STORAGE_BACKEND', 'pack')
+    save_to_knowledge_base('python.md', PYTHON_DOC, 'direct-text')
+    save_to_knowledge_base('python2.md', PYTHON_DOC_2, 'direct-text')
+
+    legacy_path = os.path.join('direct_text', 'python.md')
+    assert read_item(temp_knowledge_base, legacy_path) == PYTHON_DOC
+    response = client.get('/related/direct_text/python.md')
+    assert response.status_code == 200
+    assert response.get_json()['related'][0]['filename'] == os.path.join('direct_text', shard_for('python2.md'), 'python2.md')
+
+def test_pack_existing_files_and_export(temp_knowledge_base, tmp_path):
+    with open(os.path.join(temp_knowledge_base, 'articles', 'test_article.md'), 'r', encoding='utf-8') as f:
+        original = f.read()
+
+    assert pack_store.pack_existing_files(temp_knowledge_base) == 2
+    assert not os.path.exists(os.path.join(temp_knowledge_base, 'articles', 'test_article.md'))
+    assert read_item(temp_knowledge_base, os.path.join('articles', 'test_article.md')) == original
+    assert vector_index.rebuild_index(temp_knowledge_base) == 2
+
+    assert pack_store.export_packs(temp_knowledge_base, str(tmp_path)) == 2
+    with open(tmp_path / 'articles' / 'test_article.md', 'r', encoding='utf-8') as f:
+        assert f.read() == original
+
+def test_stats_and_reprocess_cover_packed_items(temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.storage.STORAGE_BACKEND', 'pack')
+    paths = [save_to_knowledge_base(name, doc, 'direct-text')
+             for name, doc in (('python.md', PYTHON_DOC), ('python2.md', PYTHON_DOC_2), ('garden.md', GARDEN_DOC))]
+    assert corpus_stats.num_documents(temp_knowledge_base) == 3
+
+    # The two fixture files plus the three packed items
+    assert corpus_stats.rebuild_stats(temp_knowledge_base, workers=1) == 5
+    assert corpus_stats.num_documents(temp_knowledge_base) == 5
+    assert pack_store.pack_existing_files(temp_knowledge_base) == 2
+    assert corpus_stats.rebuild_stats(temp_knowledge_base, workers=1) == 5
+
+    mocker.patch('knowledge_reinforcer.reprocess.analyze_text', return_value=("New summary.", ["new keyword"]))
+    result = reprocess_knowledge_base(temp_knowledge_base, workers=1)
+    assert result['updated'] == 5
+    for relative_path in paths:
+        metadata, _ = split_front_matter(read_item(temp_knowledge_base, relative_path))
+        assert metadata['summary'] == "New summary."
+    assert reprocess_knowledge_base(temp_knowledge_base, workers=1).get('updated', 0) == 0
+
+# Tests for crawler
+STAND_IN_SITE = {
+    '/': '<html><head><title>Home</title></head><body><a href="/a">A</a> <a href="/b#intro">B</a> <a href="http://example.org/x">Elsewhere</a></body></html>',
+    '/a': '<html><head><title>A</title></head><body><p>Page A.</p><a href="/c">C</a> <a href="/">Home</a> <a href="/file.pdf">PDF</a></body></html>',
+    '/b': '<html><head><title>B</title></head><body><p>Page B.</p><a href="/a">A</a> <a href="/missing">Missing</a></body></html>',
+    '/c': '<html><head><title>C</title></head><body><p>Page C.</p><a href="/d">D</a></body></html>',
+    '/d': '<html><head><title>D</title></head><body><p>Page D.</p></body></html>',
+    '/bad': '<html><head><title>Bad</title></head><body><a href="http://[bad">Bad</a> <a href="/d">D</a></body></html>',
+}
+
+@pytest.fixture
+def stand_in_site():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = STAND_IN_SITE.get(self.path)
+            self.send_response(200 if page else 404)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write((page or 'Not found').encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+def test_crawl_follows_same_site_links_to_max_depth(stand_in_site):
+    pages = {}
+    counts = asyncio.run(crawl(stand_in_site + '/', lambda url, html: pages.setdefault(url, html), max_depth=2))
+
+    assert sorted(pages) == [stand_in_site + path for path in ('/', '/a', '/b', '/c')]
+    assert counts == {'fetched': 4, 'failed': 1, 'processed': 4}
+
+def test_crawl_respects_max_pages(stand_in_site):
+    pages = []
+    counts = asyncio.run(crawl(stand_in_site + '/', lambda url, html: pages.append(url), max_depth=5, max_pages=2))
+    assert counts['fetched'] + counts['failed'] == 2
+    assert len(pages) == counts['fetched']
+
+def test_crawl_survives_malformed_links_and_page_errors(stand_in_site, mocker):
+    pages = []
+    counts = asyncio.run(asyncio.wait_for(
+        crawl(stand_in_site + '/bad', lambda url, html: pages.append(url), max_depth=1, concurrency=1), timeout=10))
+    assert pages == [stand_in_site + '/bad', stand_in_site + '/d']
+    assert counts['fetched'] == 2
+
+    # An unexpected error on one page must not end the only worker while pages are still queued
+    extract_links = crawler._extract_links
+    def failing_on_a(url, html, site):
+        if url.endswith('/a'):
+            raise RuntimeError("boom")
+        return extract_links(url, html, site)
+    mocker.patch.object(crawler, '_extract_links', side_effect=failing_on_a)
+    counts = asyncio.run(asyncio.wait_for(
+        crawl(stand_in_site + '/', lambda url, html: None, max_depth=2, concurrency=1), timeout=10))
+    assert counts['fetched'] == 3
+
+def test_crawl_saves_pages(stand_in_site, temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.crawler.process_content_to_markdown', side_effect=lambda content, *args: content)
+    counts = asyncio.run(crawl(stand_in_site + '/a', lambda url, html: save_page(url, html, [], ''), max_depth=0))
+    assert counts['processed'] == 1
+    saved = [path for path in iter_markdown_files(temp_knowledge_base) if os.path.basename(path).startswith('A_')]
+    assert len(saved) == 1
+    with open(saved[0], 'r', encoding='utf-8') as f:
+        assert "Page A." in f.read()
+
+def test_bloom_filter():
+    seen = BloomFilter(capacity=1000, error_rate=0.01)
+    assert seen.add('http://example.com/')
+    assert not seen.add('http://example.com/')
+    assert 'http://example.com/' in seen
+    assert 'http://example.com/other' not in seen
+
+# Tests for watcher and manifest
+def test_watcher_reconcile_tracks_edits_and_deletes(temp_knowledge_base):
+    watcher = KnowledgeBaseWatcher(temp_knowledge_base, use_inotify=False)
+    assert watcher.reconcile() == (2, 0)
+    assert watcher.reconcile() == (0, 0)
+    assert corpus_stats.load_stats(temp_knowledge_base).num_docs == 2
+
+    article = os.path.join(temp_knowledge_base, 'articles', 'test_article.md')
+    with open(article, 'w') as f:
+        f.write("---\ntitle: Edited Article\n---\n\nContent of test text, edited.")
+    os.remove(os.path.join(temp_knowledge_base, 'direct_text', 'test_text.md'))
+
+    assert watcher.reconcile() == (1, 1)
+    assert manifest.get_row(temp_knowledge_base, os.path.join('articles', 'test_article.md'))[2] == "Edited Article"
+    assert vector_index.find_related(temp_knowledge_base, os.path.join('direct_text', 'test_text.md')) is None
+    # The edit replaced the article's terms and the delete subtracted the text's
+    stats = corpus_stats.load_stats(temp_knowledge_base)
+    assert stats.num_docs == 1
+    assert stats.doc_freq[corpus_stats.term_bucket('edited')] == 1
+    assert stats.doc_freq[corpus_stats.term_bucket('article')] == 1
+    assert stats.doc_freq[corpus_stats.term_bucket('test')] == 1
+    assert stats.doc_freq[corpus_stats.term_bucket('text')] == 1
+    recounted_num_docs = corpus_stats.rebuild_stats(temp_knowledge_base, workers=1)
+    recounted = corpus_stats.load_stats(temp_knowledge_base).doc_freq
+    assert recounted_num_docs == 1 and np.array_equal(recounted, stats.doc_freq)
+
+def test_watcher_first_run_does_not_double_count(temp_knowledge_base, mocker):
+    # Items saved before the manifest existed are already in the statistics
+    for path in iter_markdown_files(temp_knowledge_base):
+        with open(path, 'r', encoding='utf-8') as f:
+            corpus_stats.add_document(temp_knowledge_base, f.read())
+    for i in range(20):
+        with open(os.path.join(temp_knowledge_base, 'articles', f'note_{i}.md'), 'w') as f:
+            f.write(f"---\ntitle: Note {i}\n---\n\nNote number {i}.")
+
+    watcher = KnowledgeBaseWatcher(temp_knowledge_base, use_inotify=False)
+    connect_spy = mocker.spy(manifest, 'connect')
+    assert watcher.reconcile() == (22, 0)
+    assert corpus_stats.load_stats(temp_knowledge_base).num_docs == 22
+    # One connection to load the manifest and one transaction to write it back
+    assert connect_spy.call_count == 2
+
+    with open(os.path.join(temp_knowledge_base, 'articles', 'note_new.md'), 'w') as f:
+        f.write("---\ntitle: New\n---\n\nA new note.")
+    assert watcher.reconcile() == (1, 0)
+    assert corpus_stats.load_stats(temp_knowledge_base).num_docs == 23
+
+def test_watcher_upgrades_manifests_without_buckets(temp_knowledge_base):
+    # A manifest written before rows kept their term buckets, for files already counted
+    article = os.path.join('articles', 'test_article.md')
+    os.makedirs(os.path.join(temp_knowledge_base, '.index'))
+    conn = sqlite3.connect(os.path.join(temp_knowledge_base, '.index', 'manifest.sqlite3'))
+    conn.execute("CREATE TABLE files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, title TEXT, date_extracted TEXT)")
+    for path in iter_markdown_files(temp_knowledge_base):
+        stat = os.stat(path)
+        conn.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                     (os.path.relpath(path, temp_knowledge_base), stat.st_mtime_ns, stat.st_size, None, None))
+        with open(path, 'r', encoding='utf-8') as f:
+            corpus_stats.add_document(temp_knowledge_base, f.read())
+    conn.commit()
+    conn.close()
+
+    watcher = KnowledgeBaseWatcher(temp_knowledge_base, use_inotify=False)
+    assert watcher.reconcile() == (2, 0)
+    assert corpus_stats.num_documents(temp_knowledge_base) == 2
+    assert manifest.get_row(temp_knowledge_base, article)[4]
+    assert watcher.reconcile() == (0, 0)
+
+    os.remove(os.path.join(temp_knowledge_base, article))
+    watcher.apply(article)
+    assert corpus_stats.num_documents(temp_knowledge_base) == 1
+    assert corpus_stats.load_stats(temp_knowledge_base).doc_freq[corpus_stats.term_bucket('article')] == 0
+
+def test_watcher_ignores_files_saved_by_the_app(temp_knowledge_base, mocker):
+    watcher = KnowledgeBaseWatcher(temp_knowledge_base, use_inotify=False)
+    watcher.reconcile()
+    relative_path = save_to_knowledge_base('note.md', PYTHON_DOC, 'direct-text')
+    index_spy = mocker.patch('knowledge_reinforcer.watcher.index_document')
+
+    watcher.notify(os.path.join(temp_knowledge_base, relative_path))
+    watcher.flush(force=True)
+    assert watcher.reconcile() == (0, 0)
+    index_spy.assert_not_called()
+
+def test_watcher_debounces_events(temp_knowledge_base, mocker):
+    watcher = KnowledgeBaseWatcher(temp_knowledge_base, debounce=60, use_inotify=False)
+    apply_spy = mocker.patch.object(watcher, 'apply')
+    article = os.path.join(temp_knowledge_base, 'articles', 'test_article.md')
+    for _ in range(5):
+        watcher.notify(article)
+    watcher.notify(os.path.join(temp_knowledge_base, '.index', 'vectors.npy'))
+
+    watcher.flush()
+    apply_spy.assert_not_called()
+    watcher.flush(force=True)
+    apply_spy.assert_called_once_with(os.path.join('articles', 'test_article.md'))
+
+def test_watcher_polling_picks_up_new_files(temp_knowledge_base):
+    watcher = KnowledgeBaseWatcher(temp_knowledge_base, debounce=0.05, poll_interval=0.1, use_inotify=False)
+    watcher.start()
+    try:
+        with open(os.path.join(temp_knowledge_base, 'direct_text', 'by_hand.md'), 'w') as f:
+            f.write(PYTHON_DOC)
+        deadline = time.monotonic() + 5
+        while manifest.get_row(temp_knowledge_base, os.path.join('direct_text', 'by_hand.md')) is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+    assert vector_index.find_related(temp_knowledge_base, os.path.join('direct_text', 'by_hand.md')) is not None
+
+def test_browse_lists_changed_files_without_watcher(client, temp_knowledge_base):
+    KnowledgeBaseWatcher(temp_knowledge_base, use_inotify=False).reconcile()
+    with open(os.path.join(temp_knowledge_base, 'articles', 'test_article.md'), 'w') as f:
+        f.write("---\ntitle: Renamed Article\n---\n\nNew content.")
+
+    response = client.get('/browse')
+    assert b"Renamed Article" in response.data
+    assert b"Test Text" in response.data
+
+# Tests for the JSON API
+def _wait_for_jobs(client, job_ids):
+    deadline = time.monotonic() + 5
+    while True:
+        jobs = client.post('/api/jobs', json={'ids': job_ids}).get_json()['jobs']
+        if all(job['status'] in ('done', 'failed') for job in jobs.values()):
+            return jobs
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_api_bulk_ingest_accepts_gzip(client, temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.web_app.process_content_to_markdown', side_effect=lambda raw, *args: f"---\ntitle: T\n---\n\n{raw}")
+    mocker.patch('knowledge_reinforcer.web_app.fetch_content', return_value=(None, None))
+    payload = {'items': [{'text': 'First note.'}, {'text': 'Second note.', 'tags': ['a', 'b']},
+                         {'url': 'http://example.com/gone'}, {'purpose': 'nothing to ingest'}]}
+    response = client.post('/api/ingest', data=gzip.compress(json.dumps(payload).encode('utf-8')),
+                           headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/json'})
+    assert response.status_code == 202
+    job_ids = response.get_json()['jobs']
+    assert len(job_ids) == 4
+
+    jobs = _wait_for_jobs(client, job_ids)
+    assert [jobs[job_id]['status'] for job_id in job_ids] == ['done', 'done', 'failed', 'failed']
+    assert jobs[job_ids[2]]['error'] == "Could not fetch content from http://example.com/gone."
+    for job_id in job_ids[:2]:
+        assert os.path.isfile(os.path.join(temp_knowledge_base, jobs[job_id]['path']))
+    assert jobs[job_ids[0]]['path'] != jobs[job_ids[1]]['path']
+
+def test_api_concurrent_ingest_keeps_index_consistent(client, temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.web_app.process_content_to_markdown', side_effect=lambda raw, *args: f"---\ntitle: T\n---\n\n{raw}")
+    payload = {'items': [{'text': f"Note number {i} about topic{i}."} for i in range(100)]}
+    job_ids = client.post('/api/ingest', json=payload).get_json()['jobs']
+    jobs = _wait_for_jobs(client, job_ids)
+    assert all(job['status'] == 'done' for job in jobs.values())
+
+    index = vector_index.VectorIndex(temp_knowledge_base)
+    for job in jobs.values():
+        with open(os.path.join(temp_knowledge_base, job['path']), 'r', encoding='utf-8') as f:
+            expected = index.embed(vector_index.document_text(f.read()))
+        _, vector = index.vector_for(job['path'])
+        np.testing.assert_allclose(vector, expected, atol=1e-6)
+    assert corpus_stats.num_documents(temp_knowledge_base) == 100
+
+def test_api_jobs_are_shared_between_workers(client, temp_knowledge_base, mocker):
+    # Another web worker process records its jobs in the same SQLite file
+    job_store.create_jobs(temp_knowledge_base, [('a' * 32, 'queued', None), ('b' * 32, 'failed', "No text.")])
+    job_store.update_job(temp_knowledge_base, 'a' * 32, 'done', path='articles/a.md')
+    jobs = client.post('/api/jobs', json={'ids': ['a' * 32, 'b' * 32, 'c' * 32]}).get_json()['jobs']
+    assert jobs == {'a' * 32: {'status': 'done', 'path': 'articles/a.md'},
+                    'b' * 32: {'status': 'failed', 'error': "No text."},
+                    'c' * 32: {'status': 'unknown'}}
+    assert client.post('/api/jobs', json={'ids': [1]}).status_code == 400
+    many = ['a' * 32] + [f"missing{i}" for i in range(web_app.MAX_BULK_ITEMS - 1)]
+    jobs = client.post('/api/jobs', json={'ids': many}).get_json()['jobs']
+    assert len(jobs) == web_app.MAX_BULK_ITEMS and jobs['a' * 32]['status'] == 'done'
+
+    mocker.patch.object(job_store, 'MAX_TRACKED_JOBS', 3)
+    job_store.create_jobs(temp_knowledge_base, [(str(i), 'queued', None) for i in range(3)])
+    statuses = job_store.get_jobs(temp_knowledge_base, ['a' * 32, '0', '2'])
+    assert [job['status'] for job in statuses.values()] == ['unknown', 'queued', 'queued']
+
+def test_api_ingest_rejects_bad_payload(client):
+    assert client.post('/api/ingest', json={'items': []}).status_code == 400
+    assert client.post('/api/ingest', data=b'not json').status_code == 400
+
+def test_api_rejects_oversized_bodies(client, mocker):
+    mocker.patch.object(web_app, 'MAX_JSON_BYTES', 1024)
+    bomb = gzip.compress(json.dumps({'items': [{'text': ' ' * 100000}]}).encode('utf-8'))
+    response = client.post('/api/ingest', data=bomb, headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+    truncated = gzip.compress(b'{"items": []}')[:-8]
+    assert client.post('/api/ingest', data=truncated, headers={'Content-Encoding': 'gzip'}).status_code == 400
+
+    mocker.patch.dict(web_app.app.config, {'MAX_CONTENT_LENGTH': 1024})
+    response = client.post('/api/ingest', json={'items': [{'text': 'x' * 2048}]})
+    assert response.status_code == 413
+
+def test_api_bulk_metadata(client, temp_knowledge_base):
+    response = client.post('/api/metadata', json={'paths': ['articles/test_article.md', 'articles/missing.md']},
+                           headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    items = json.loads(gzip.decompress(response.data))['items']
+    assert items == {'articles/test_article.md': {'title': 'Test Article'}, 'articles/missing.md': None}
+    assert client.post('/api/metadata', json={'paths': [['x']]}).status_code == 400
+
+def test_paths_outside_the_knowledge_base_are_never_read(client, temp_knowledge_base, tmp_path):
+    outside = tmp_path / 'outside' / 'secret.md'
+    outside.parent.mkdir()
+    outside.write_text("---\ntitle: Secret\n---\n\nNot part of the knowledge base.")
+    escaping = os.path.relpath(str(outside), temp_knowledge_base)
+
+    response = client.post('/api/metadata', json={'paths': [str(outside), escaping]})
+    assert response.get_json()['items'] == {str(outside): None, escaping: None}
+    assert resolve_path(temp_knowledge_base, escaping) is None
+    assert client.get('/view/' + escaping).status_code == 404
+    assert read_item(temp_knowledge_base, os.path.join('articles', '..', 'articles', 'test_article.md')) is not None
+
+def test_api_export_streams_ndjson(client, temp_knowledge_base):
+    response = client.get('/api/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in gzip.decompress(response.data).splitlines()]
+    assert {line['path'] for line in lines} == {os.path.join('articles', 'test_article.md'), os.path.join('direct_text', 'test_text.md')}
+    assert any(line['metadata']['title'] == 'Test Text' and 'Content of test text.' in line['body'] for line in lines)
+
+    plain = client.get('/api/export')
+    assert len(plain.data.splitlines()) == 2
+
+# Tests for nlp_pool
+def test_nlp_pool_dispatches_to_worker_processes(mocker):
+    mocker.patch.object(nlp_pool, 'NLP_WORKERS', 2)
+    try:
+        assert nlp_pool.analyze("", 1, 3, BASE_KNOWLEDGE_DIR) == ("", [])
+        executor = nlp_pool.start_pool()
+        worker_pids = {executor.submit(nlp_pool._ping).result() for _ in range(8)}
+        assert os.getpid() not in worker_pids
+    finally:
+        nlp_pool.shutdown_pool()
+
+def test_nlp_pool_disabled_runs_inline(mocker):
+    mocker.patch.object(nlp_pool, 'NLP_WORKERS', 0)
+    mocker.patch('knowledge_reinforcer.analysis_cache._cache', AnalysisCache(16))
+    analyze_spy = mocker.patch('knowledge_reinforcer.processor.analyze_text_local', return_value=("S.", ["k"]))
+    from knowledge_reinforcer.processor import analyze_text
+    assert analyze_text("Some text.") == ("S.", ["k"])
+    assert nlp_pool._executor is None
+    analyze_spy.assert_called_once()
+
+# Tests for analysis_cache
+def test_analysis_cache_evicts_least_recently_used():
+    cache = AnalysisCache(2)
+    cache.put('a', ("A.", []))
+    cache.put('b', ("B.", []))
+    assert cache.get('a') == ("A.", [])
+    cache.put('c', ("C.", []))
+    assert cache.get('b') is None
+    assert cache.get('a') == ("A.", [])
+    assert cache.get('c') == ("C.", [])
+
+def test_analysis_cache_persists_to_sqlite(tmp_path):
+    db_path = str(tmp_path / 'analysis_cache.sqlite3')
+    AnalysisCache(4, db_path).put('key', ("Summary.", ["keyword"]))
+    assert AnalysisCache(4, db_path).get('key') == ("Summary.", ["keyword"])
+    assert AnalysisCache(4).get('key') is None
+
+def test_analysis_cache_pruning_keeps_results_read_from_sqlite(tmp_path, mocker):
+    mocker.patch('knowledge_reinforcer.analysis_cache.DB_MAX_ROWS', 2)
+    mocker.patch('knowledge_reinforcer.analysis_cache.DB_PRUNE_EVERY', 3)
+    mocker.patch('knowledge_reinforcer.analysis_cache.time.time', side_effect=itertools.count())
+    db_path = str(tmp_path / 'analysis_cache.sqlite3')
+    writer = AnalysisCache(4, db_path)
+    writer.put('old', ("Old.", []))
+    writer.put('b', ("B.", []))
+    # Another process reads 'old', which makes it the most recently used row
+    assert AnalysisCache(4, db_path).get('old') == ("Old.", [])
+    writer.put('c', ("C.", []))
+    reader = AnalysisCache(4, db_path)
+    assert reader.get('old') == ("Old.", [])
+    assert reader.get('b') is None
+
+def test_analyze_text_reuses_cached_results(temp_knowledge_base, mocker):
+    mocker.patch('knowledge_reinforcer.analysis_cache._cache', AnalysisCache(16))
+    analyze_spy = mocker.patch.object(nlp_pool, 'analyze', return_value=("S.", ["k"]))
+    from knowledge_reinforcer.processor import analyze_text
+    assert analyze_text("Same text.") == ("S.", ["k"])
+    assert analyze_text("Same text.") == ("S.", ["k"])
+    assert analyze_spy.call_count == 1
+    analyze_text("Same text.", num_keywords=5)
+    analyze_text("Other text.")
+    assert analyze_spy.call_count == 3